@@ -1,6 +1,582 @@
 import cv2
 import numpy as np
+import collections
+import contextlib
+import json
 import os
+import queue
+import threading
+import time
+
+
+def filter_outputs(outs, frameWidth, frameHeight, confThreshold):
+    """把网络所有输出层的结果拼成一个矩阵，一次性用numpy筛选出置信度大于阈值的框，
+    代替逐行的python循环
+
+    Parameters
+    -----------
+    * outs: list
+        - net.forward的输出，每一层是N x (5 + 类别数)的矩阵
+    * frameWidth: int
+        - 原图宽度
+    * frameHeight: int
+        - 原图高度
+    * confThreshold: float
+        - 置信度阈值
+
+    Return
+    -----------
+    * numpy array:
+        - 每个框的类别编号
+    * numpy array:
+        - 每个框的置信度
+    * numpy array:
+        - 每个框的[left, top, width, height]，原图坐标
+    """
+    out = outs[0] if len(outs) == 1 else np.concatenate(outs)
+    out = out.reshape(-1, out.shape[-1])
+    scores = out[:, 5:]
+    # 先用每行的最大分数筛选，只对留下的行求类别
+    keep = np.flatnonzero(scores.max(axis=1) > confThreshold)
+    scores = scores[keep]
+    classIds = scores.argmax(axis=1)
+    confidences = scores[np.arange(len(keep)), classIds]
+    rows = out[keep, :4].astype(np.float64) * [frameWidth, frameHeight, frameWidth, frameHeight]
+    boxes = rows.copy()
+    boxes[:, :2] -= rows[:, 2:] / 2
+    return classIds, confidences, boxes
+
+
+def nms_indices(boxes, confidences, confThreshold, nmsThreshold):
+    """非极大值抑制
+
+    Return
+    -----------
+    * numpy array:
+        - 保留下来的框的下标
+    """
+    if not len(boxes):
+        return np.empty(0, dtype=np.int64)
+    indices = cv2.dnn.NMSBoxes(boxes.tolist(), confidences.tolist(), confThreshold, nmsThreshold)
+    # 不同版本的opencv返回Nx1或N的数组
+    return np.asarray(indices, dtype=np.int64).reshape(-1)
+
+
+def split_outputs(outs, count):
+    """把一次批量前向计算的输出按图片拆开
+
+    Parameters
+    -----------
+    * outs: list
+        - net.forward的输出，每一层是count x N x (5 + 类别数)，
+          或者(有的opencv版本)count * N x (5 + 类别数)的矩阵
+    * count: int
+        - 图片数
+
+    Return
+    -----------
+    * list:
+        - 每张图片一项，和单张图片时net.forward的输出格式一样
+    """
+    layers = [out.reshape(count, -1, out.shape[-1]) for out in outs]
+    return [[layer[i] for layer in layers] for i in range(count)]
+
+
+DETECTION_DTYPE = np.dtype([('class_id', '<i4'), ('name', 'U32'), ('confidence', '<f4'),
+                            ('x', '<f4'), ('y', '<f4'), ('w', '<f4'), ('h', '<f4'), ('seq', '<i8')])
+
+
+class Detections:
+    """一帧图像的识别结果，保存在numpy结构化数组中，每个物体一行:
+    类别编号class_id、名称name、置信度confidence、矩形框左上角x、y和宽高w、h(原图坐标)、帧序号seq
+    用法:
+        detections = ai.detect(frame)
+        cup = detections.best('cup')
+        if cup is not None:
+            print(cup['x'] + cup['w'] / 2, cup['confidence'])
+    """
+    __slots__ = ('records',)
+
+    def __init__(self, records=None):
+        """
+        Parameters
+        -----------
+        * records: numpy array
+            - DETECTION_DTYPE类型的结构化数组，None表示没有物体
+        """
+        self.records = np.empty(0, DETECTION_DTYPE) if records is None else records
+
+    @staticmethod
+    def from_arrays(classIds, confidences, boxes, classes, seq=-1):
+        """由类别编号、置信度和[left, top, width, height]矩形框生成
+
+        Parameters
+        -----------
+        * classIds: numpy array
+            - 每个物体的类别编号
+        * confidences: numpy array
+            - 每个物体的置信度
+        * boxes: numpy array
+            - N x 4的矩形框
+        * classes: list
+            - 类别名称
+        * seq: int
+            - 帧序号，-1表示未知
+        """
+        records = np.empty(len(classIds), DETECTION_DTYPE)
+        records['class_id'] = classIds
+        records['name'] = [classes[i] for i in classIds]
+        records['confidence'] = confidences
+        if len(records):
+            records['x'], records['y'], records['w'], records['h'] = np.asarray(boxes).T
+        records['seq'] = seq
+        return Detections(records)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, key):
+        """整数下标返回一个物体(numpy.void，按字段名访问)，切片或布尔数组返回Detections
+        """
+        if isinstance(key, (int, np.integer)):
+            return self.records[key]
+        return Detections(self.records[key])
+
+    def __repr__(self):
+        return 'Detections(%s)' % ', '.join('%s:%.2f' % (r['name'], r['confidence']) for r in self.records)
+
+    @property
+    def names(self):
+        """每个物体的名称(list)
+        """
+        return self.records['name'].tolist()
+
+    @property
+    def boxes(self):
+        """N x 4的[left, top, width, height]矩形框
+        """
+        return np.stack([self.records['x'], self.records['y'], self.records['w'], self.records['h']], axis=1)
+
+    @property
+    def centres(self):
+        """N x 2的矩形框中心点
+        """
+        return np.stack([self.records['x'] + self.records['w'] / 2,
+                         self.records['y'] + self.records['h'] / 2], axis=1)
+
+    def filter(self, names=None, class_ids=None, min_confidence=None):
+        """按类别和置信度筛选
+
+        Parameters
+        -----------
+        * names: str or list
+            - 保留的物体名称，None表示不按名称筛选
+        * class_ids: int or list
+            - 保留的类别编号，None表示不按编号筛选
+        * min_confidence: float
+            - 最低置信度，None表示不按置信度筛选
+
+        Return
+        -----------
+        * Detections:
+            - 筛选后的结果
+        """
+        mask = np.ones(len(self.records), bool)
+        if names is not None:
+            mask &= np.isin(self.records['name'], [names] if isinstance(names, str) else list(names))
+        if class_ids is not None:
+            mask &= np.isin(self.records['class_id'], class_ids)
+        if min_confidence is not None:
+            mask &= self.records['confidence'] >= min_confidence
+        return Detections(self.records[mask])
+
+    def best(self, name=None):
+        """置信度最高的物体
+
+        Parameters
+        -----------
+        * name: str
+            - 物体名称，None表示所有物体
+
+        Return
+        -----------
+        * numpy.void or None:
+            - 置信度最高的物体，没有时返回None
+        """
+        records = self.records if name is None else self.records[self.records['name'] == name]
+        if not len(records):
+            return None
+        return records[np.argmax(records['confidence'])]
+
+    def best_of_class(self):
+        """每个类别中置信度最高的物体
+
+        Return
+        -----------
+        * Detections:
+            - 每个类别一行，按类别编号排序
+        """
+        records = self.records[np.argsort(-self.records['confidence'], kind='stable')]
+        _, first = np.unique(records['class_id'], return_index=True)
+        return Detections(records[first])
+
+    def to_lists(self):
+        """转换成get_rect原来的返回格式
+
+        Return
+        -----------
+        * list:
+            - 每个物体的中心点[x, y]
+        * list:
+            - 每个物体的名称
+        """
+        return self.centres.tolist(), self.names
+
+
+def query_output_names(net):
+    """查询网络的输出层名字
+    """
+    layersNames = net.getLayerNames()
+    # Get the names of the output layers, i.e. the layers with unconnected outputs
+    layers = np.asarray(net.getUnconnectedOutLayers()).reshape(-1)
+    return [layersNames[i - 1] for i in layers]
+
+
+class Model:
+    """一个加载好的网络和它的副本，由ModelRegistry创建，多个Ai共用
+    """
+
+    def __init__(self, config, weights, warmup_size=(188, 188)):
+        """
+        Parameters
+        -----------
+        * config: str
+            - 网络配置文件(.cfg)
+        * weights: str
+            - 网络权重文件(.weights)
+        * warmup_size: tuple
+            - 预热时输入的(宽, 高)
+        """
+        self.config = config
+        self.weights = weights
+        self.warmup_size = warmup_size
+        self.outNames = None
+        self.replicas = 0
+        self.load_times = []  # 每个副本读取文件、解析网络的时间(秒)
+        self.warmup_times = []  # 每个副本第一次前向计算的时间(秒)
+        self._nets = queue.Queue()
+        self._lock = threading.Lock()
+        self.net = self._add_replica()
+
+    def _add_replica(self):
+        """加载一个网络副本并预热
+        """
+        start = time.time()
+        net = cv2.dnn.readNetFromDarknet(self.config, self.weights)
+        net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        if self.outNames is None:
+            self.outNames = query_output_names(net)
+        loaded = time.time()
+        # 第一次前向计算要分配内存、初始化各层，比之后慢很多，加载时用全零的输入先算一次
+        width, height = self.warmup_size
+        net.setInput(np.zeros((1, 3, height, width), np.float32))
+        net.forward(self.outNames)
+        self.load_times.append(loaded - start)
+        self.warmup_times.append(time.time() - loaded)
+        self.replicas += 1
+        self._nets.put(net)
+        return net
+
+    def ensure_replicas(self, count):
+        """保证至少有count个网络副本
+        """
+        with self._lock:
+            while self.replicas < count:
+                self._add_replica()
+
+    @contextlib.contextmanager
+    def checkout(self, timeout=None):
+        """借用一个网络副本，见Ai.checkout
+        """
+        net = self._nets.get(timeout=timeout)
+        try:
+            yield net
+        finally:
+            self._nets.put(net)
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - replicas: 网络副本数
+            - load_s: 第一个副本读取文件、解析网络的时间(秒)
+            - warmup_s: 第一个副本预热的时间(秒)
+        """
+        return {'replicas': self.replicas, 'load_s': self.load_times[0], 'warmup_s': self.warmup_times[0]}
+
+
+class ModelRegistry:
+    """进程内的模型注册表，每个(cfg, weights)只加载一次，之后新建的Ai直接使用已经加载好的网络
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models = {}  # (cfg路径, weights路径) -> Model
+        self.hits = 0  # 直接使用已加载模型的次数
+        self.misses = 0  # 从文件加载模型的次数
+
+    @staticmethod
+    def key(config, weights):
+        return os.path.abspath(config), os.path.abspath(weights)
+
+    def load(self, config, weights, replicas=1, warmup_size=(188, 188)):
+        """取得模型，第一次使用时从文件加载并预热
+
+        Parameters
+        -----------
+        * config: str
+            - 网络配置文件(.cfg)
+        * weights: str
+            - 网络权重文件(.weights)
+        * replicas: int
+            - 至少需要的网络副本数
+        * warmup_size: tuple
+            - 预热时输入的(宽, 高)
+
+        Return
+        -----------
+        * Model:
+            - 加载好的模型
+        """
+        key = self.key(config, weights)
+        with self._lock:
+            model = self._models.get(key)
+            if model is None:
+                model = self._models[key] = Model(config, weights, warmup_size)
+                self.misses += 1
+            else:
+                self.hits += 1
+        model.ensure_replicas(replicas)
+        return model
+
+    def unload(self, config, weights):
+        """从注册表中删除模型，正在使用它的Ai不受影响
+        """
+        with self._lock:
+            return self._models.pop(self.key(config, weights), None)
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - hits/misses: 使用已加载模型和从文件加载的次数
+            - models: cfg路径 -> Model.stats()
+        """
+        with self._lock:
+            models = dict((key[0], model.stats()) for key, model in self._models.items())
+            return {'hits': self.hits, 'misses': self.misses, 'models': models}
+
+
+registry = ModelRegistry()  # 进程内所有Ai共用的模型注册表
+
+
+class ResolutionController:
+    """按延迟预算调整网络输入尺寸：最近window次识别的平均耗时超过预算时减小32，
+    增大32后(耗时大约和像素数成正比)仍然低于预算的headroom倍时增大32
+    """
+
+    def __init__(self, budget, size=192, min_size=128, max_size=416, step=32, window=8, headroom=0.8):
+        """
+        Parameters
+        -----------
+        * budget: float
+            - 每一帧识别的延迟预算(秒)
+        * size: int
+            - 初始输入尺寸，会取最接近的step的倍数
+        * min_size: int
+            - 最小输入尺寸
+        * max_size: int
+            - 最大输入尺寸
+        * step: int
+            - 每次调整的大小，yolov3的输入要是32的倍数
+        * window: int
+            - 用最近window次的耗时计算平均值
+        * headroom: float
+            - 预计耗时低于预算的headroom倍时才增大，防止来回调整
+        """
+        self.budget = budget
+        self.step = step
+        self.min_size = max(step, min_size // step * step)
+        self.max_size = max(self.min_size, max_size // step * step)
+        self.size = min(max(int(round(size / step)) * step, self.min_size), self.max_size)
+        self.window = window
+        self.headroom = headroom
+        self.changes = 0  # 调整的次数
+        self._times = collections.deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def update(self, seconds, size=None):
+        """记录一次识别的耗时
+
+        Parameters
+        -----------
+        * seconds: float
+            - 识别耗时(秒)
+        * size: int
+            - 这次识别使用的输入尺寸，和当前尺寸不同时不计入
+
+        Return
+        -----------
+        * int:
+            - 之后使用的输入尺寸
+        """
+        with self._lock:
+            if size is not None and size != self.size:
+                return self.size
+            self._times.append(seconds)
+            if len(self._times) < self.window:
+                return self.size
+            mean = sum(self._times) / len(self._times)
+            larger = self.size + self.step
+            if mean > self.budget and self.size > self.min_size:
+                self.size -= self.step
+            elif larger <= self.max_size and mean * (larger / self.size) ** 2 < self.budget * self.headroom:
+                self.size = larger
+            else:
+                return self.size
+            self.changes += 1
+            self._times.clear()
+            return self.size
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - size: 当前输入尺寸
+            - mean_ms: 当前尺寸最近的平均耗时(毫秒)
+            - budget_ms: 延迟预算(毫秒)
+            - changes: 调整的次数
+        """
+        with self._lock:
+            mean = sum(self._times) / len(self._times) if self._times else 0.0
+            return {'size': self.size, 'mean_ms': mean * 1000, 'budget_ms': self.budget * 1000,
+                    'changes': self.changes}
+
+
+class RoiController:
+    """记录跟随物体的最新位置，给出下一帧要识别的窗口：以物体框中心为中心，边长为框的expand倍，
+    移到图片以内；物体丢失后没有窗口，由全图识别重新找到
+    """
+
+    def __init__(self, name, expand=2.5, min_size=160, max_size=416):
+        """
+        Parameters
+        -----------
+        * name: str
+            - 跟随的物体名称
+        * expand: float
+            - 窗口边长是物体框边长的倍数
+        * min_size: int
+            - 窗口的最小边长
+        * max_size: int
+            - 网络输入的最大边长
+        """
+        self.name = name
+        self.expand = expand
+        self.min_size = min_size
+        self.max_size = max_size
+        self.box = None  # 物体最近的[left, top, width, height]，None表示丢失
+        self.window_hits = 0  # 在窗口中找到物体的次数
+        self.window_misses = 0  # 在窗口中丢失物体、回到全图识别的次数
+        self.full_frames = 0  # 全图识别的次数
+        self._lock = threading.Lock()
+
+    def window(self, frameWidth, frameHeight):
+        """下一帧要识别的窗口
+
+        Return
+        -----------
+        * tuple or None:
+            - (left, top, width, height)，物体丢失时返回None
+        """
+        with self._lock:
+            box = self.box
+        if box is None:
+            return None
+        left, top, width, height = box
+        side = max(max(width, height) * self.expand, self.min_size)
+        width, height = int(min(side, frameWidth)), int(min(side, frameHeight))
+        left = int(min(max(left + box[2] / 2 - width / 2, 0), frameWidth - width))
+        top = int(min(max(top + box[3] / 2 - height / 2, 0), frameHeight - height))
+        return left, top, width, height
+
+    def update(self, detections, window=None):
+        """记录一次识别的结果
+
+        Parameters
+        -----------
+        * detections: Detections
+            - 识别结果(原图坐标)
+        * window: tuple
+            - 识别的窗口，None表示全图
+
+        Return
+        -----------
+        * bool:
+            - 是否找到了物体
+        """
+        target = detections.best(self.name)
+        with self._lock:
+            if window is None:
+                self.full_frames += 1
+            elif target is None:
+                self.window_misses += 1
+            else:
+                self.window_hits += 1
+            self.box = None if target is None else \
+                (float(target['x']), float(target['y']), float(target['w']), float(target['h']))
+        return target is not None
+
+    def track(self, detections):
+        """用跟踪得到的位置(例如TrackingDetector只跟踪的帧)更新物体框，不计入统计
+
+        Parameters
+        -----------
+        * detections: Detections
+            - 跟踪结果(原图坐标)，没有物体时不改变物体框
+
+        Return
+        -----------
+        * bool:
+            - 是否有物体
+        """
+        target = detections.best(self.name)
+        if target is None:
+            return False
+        with self._lock:
+            self.box = (float(target['x']), float(target['y']), float(target['w']), float(target['h']))
+        return True
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - window_hits: 在窗口中找到物体的次数
+            - window_misses: 在窗口中丢失物体的次数
+            - full_frames: 全图识别的次数
+            - box: 物体最近的位置
+        """
+        with self._lock:
+            return {'window_hits': self.window_hits, 'window_misses': self.window_misses,
+                    'full_frames': self.full_frames, 'box': self.box}
 
 
 class Ai:
@@ -8,7 +584,7 @@ class Ai:
     利用Yolo对物体进行识别和初步定位
     """
 
-    def __init__(self, classes=None, config=None, weights=None):
+    def __init__(self, classes=None, config=None, weights=None, replicas=1, settings=None):
         """
         *function:__init_
         Parameters
@@ -16,6 +592,8 @@ class Ai:
         classes: path to the file containing classification names.
         config: path to the file containing yolov3 configuration.
         weights: path to the file containing yolov3 model weights
+        replicas: number of network copies, detect can run in that many threads at the same time
+        settings: path to the json file written by thinkland_rpi_ai_tuner, see load_settings
 
         Defaults refer to coco.names, yolov3.cfg, yolov3.weights all installed in the package containing this module
 
@@ -30,10 +608,9 @@ class Ai:
             config = os.path.join(os.path.dirname(__file__), "coco/yolov3.cfg")
         if weights is None:
             weights = os.path.join(os.path.dirname(__file__), "coco/yolov3.weights")
-        self.confThreshold = 0.1  # Confidence threshold
-        self.nmsThreshold = 0.6  # Non-maximum suppression threshold
-        self.inpWidth = 188  # Width of network's input image
-        self.inpHeight = 188  # Height of n
+        self.reset_settings()
+        if settings is not None:
+            self.load_settings(settings)
 
         self.classesFile = classes
 
@@ -45,17 +622,319 @@ class Ai:
         self.modelConfiguration = config
         self.modelWeights = weights
 
-        self.net = cv2.dnn.readNetFromDarknet(self.modelConfiguration, self.modelWeights)
-        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
-        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        # 同一个(cfg, weights)在进程中只加载一次，所有Ai共用；同一个网络不能在多个线程中
+        # 同时setInput/forward，每次识别从模型中借用一个网络副本
+        start = time.time()
+        self.model = registry.load(config, weights, replicas, (self.inpWidth, self.inpHeight))
+        self.net = self.model.net
+        # 输出层的名字在加载时查询一次，之后每一帧直接使用
+        self.outNames = self.model.outNames
+        self._local = threading.local()  # 每个线程自己的输入缓冲区
+        self.resolution = None  # 按延迟预算调整输入尺寸，见set_latency_budget
+        self.roi = None  # 只识别物体附近的窗口，见set_roi
+        self.startup_time = time.time() - start  # 加载(或从注册表取得)模型用的时间(秒)
+
+    @property
+    def replicas(self):
+        """网络副本数，detect可以同时在这么多个线程中运行
+        """
+        return self.model.replicas
+
+    def checkout(self, timeout=None):
+        """借用一个网络副本，用with语句，结束时自动归还；所有副本都在使用时等待
+            with ai.checkout() as net:
+                net.setInput(blob)
+                outs = net.forward(ai.outNames)
+
+        Parameters
+        -----------
+        * timeout: float
+            - 最长等待时间(秒)，None表示一直等待，超时抛出queue.Empty
+        """
+        return self.model.checkout(timeout)
+
+    def set_latency_budget(self, budget, min_size=128, max_size=416, window=8):
+        """设置每一帧识别的延迟预算，之后detect根据最近的耗时自动调整输入尺寸(32的倍数)，
+        电脑同时在显示、录像时帧率也能保持稳定
+
+        Parameters
+        -----------
+        * budget: float
+            - 延迟预算(秒)，None表示关闭，保持当前的输入尺寸
+        * min_size: int
+            - 最小输入尺寸
+        * max_size: int
+            - 最大输入尺寸
+        * window: int
+            - 用最近window次的耗时计算平均值
+        """
+        if budget is None:
+            self.resolution = None
+            return
+        self.resolution = ResolutionController(budget, self.inpWidth, min_size, max_size, window=window)
+        self.inpWidth = self.inpHeight = self.resolution.size
+
+    def set_roi(self, name, expand=2.5, min_size=160, max_size=416):
+        """找到物体以后，detect只识别上一次物体位置附近的窗口(原始分辨率)，找不到时回到全图识别
+
+        Parameters
+        -----------
+        * name: str
+            - 跟随的物体名称，例如'cup'，None表示关闭
+        * expand: float
+            - 窗口边长是物体框边长的倍数
+        * min_size: int
+            - 窗口的最小边长
+        * max_size: int
+            - 网络输入的最大边长，窗口更大时缩小输入
+        """
+        self.roi = None if name is None else RoiController(name, expand, min_size, max_size)
+
+    def reset_settings(self):
+        """输入尺寸和阈值恢复成默认值
+        """
+        self.confThreshold = 0.1  # Confidence threshold
+        self.nmsThreshold = 0.6  # Non-maximum suppression threshold
+        self.inpWidth = 188  # Width of network's input image
+        self.inpHeight = 188  # Height of n
+
+    def load_settings(self, path, budget_ms=None):
+        """使用thinkland_rpi_ai_tuner离线调整得到的输入尺寸和阈值
+
+        Parameters
+        -----------
+        * path: str
+            - thinkland_rpi_ai_tuner写入的json文件
+        * budget_ms: float
+            - 每一帧识别的最大耗时(毫秒)，在帕累托最优的设置中选不超过它且F1最高的一个；
+              None表示使用文件中选好的设置(selected)
+
+        Return
+        -----------
+        * dict or None:
+            - 使用的设置，文件中没有设置时返回None
+        """
+        with open(path, 'rt') as f:
+            settings = json.load(f)
+        selected = settings.get('selected')
+        if budget_ms is not None and settings.get('pareto'):
+            front = settings['pareto']
+            within = [r for r in front if r['latency_ms'] <= budget_ms]
+            selected = max(within, key=lambda r: r['f1']) if within else min(front, key=lambda r: r['latency_ms'])
+        if selected is None:
+            return None
+        self.inpWidth = self.inpHeight = int(selected['size'])
+        self.confThreshold = float(selected['confThreshold'])
+        self.nmsThreshold = float(selected['nmsThreshold'])
+        return selected
 
     def getOutputsNames(self):
         """Get the names of the output layers, i.e. the layers with unconnected outputs
 
         """
-        self.layersNames = self.net.getLayerNames()
-        # Get the names of the output layers, i.e. the layers with unconnected outputs
-        return [self.layersNames[i[0] - 1] for i in self.net.getUnconnectedOutLayers()]
+        return self.outNames
+
+    def make_blob(self, frame, size=None):
+        """把图片缩放、归一化成网络的输入，和cv2.dnn.blobFromImage(frame, 1 / 255, size, [0, 0, 0], 1)结果一样，
+        但每个线程的每一帧重复使用同一块内存
+
+        Parameters
+        -----------
+        * frame: numpy array
+            - BGR图像(uint8)，灰度图会先转换成BGR
+        * size: tuple
+            - 网络输入的(宽, 高)，None表示(inpWidth, inpHeight)
+
+        Return
+        -----------
+        * numpy array:
+            - 1 x 3 x 高 x 宽的float32矩阵
+        """
+        if frame.dtype != np.uint8:
+            raise ValueError('expected a uint8 image, got %s' % frame.dtype)
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        elif frame.ndim != 3 or frame.shape[2] != 3:
+            raise ValueError('expected a BGR or grayscale image, got shape %s' % (frame.shape,))
+        local = self._local
+        width, height = size if size is not None else (self.inpWidth, self.inpHeight)
+        blob = getattr(local, 'blob', None)
+        if blob is None or blob.shape != (1, 3, height, width):
+            blob = local.blob = np.empty((1, 3, height, width), np.float32)
+            local.resized = np.empty((height, width, 3), np.uint8)
+        # dst不匹配时cv2.resize会返回新数组，用返回值才不会拿到上一帧的内容
+        resized = cv2.resize(frame, (width, height), dst=local.resized)
+        # HWC的BGR转换成CHW的RGB，同时乘以1/255
+        np.multiply(resized.transpose(2, 0, 1)[::-1], 1 / 255, out=blob[0], casting='unsafe')
+        return blob
+
+    def detect(self, frame, seq=None):
+        """识别一张图片中的物体，find_object和get_rect都通过它完成识别
+
+        Parameters
+        -----------
+        * frame: numpy array or Frame
+            - BGR图像，也可以是Camera.take_frame返回的帧或borrow_picture返回的FrameLoan
+        * seq: int
+            - 帧序号，None时使用frame.seq，没有时为-1
+
+        Return
+        -----------
+        * Detections:
+            - 识别结果
+        """
+        if seq is None:
+            seq = getattr(frame, 'seq', -1)
+        if not isinstance(frame, np.ndarray):
+            frame = frame.image
+        roi = self.roi
+        if roi is not None:
+            window = roi.window(frame.shape[1], frame.shape[0])
+            if window is not None:
+                detections = self.detect_window(frame, window, seq, roi.max_size)
+                if roi.update(detections, window):
+                    return detections
+            # 目标丢失，回到全图识别
+        start = time.time()
+        # 只读一次输入尺寸，其他线程同时修改时blob和耗时记录用的也是同一个尺寸
+        size = (self.inpWidth, self.inpHeight)
+        detections = self.detect_blob(self.make_blob(frame, size), frame, seq)
+        resolution = self.resolution
+        if resolution is not None:
+            self.inpWidth = self.inpHeight = resolution.update(time.time() - start, size[0])
+        if roi is not None:
+            roi.update(detections)
+        return detections
+
+    def detect_window(self, frame, window, seq=-1, max_size=416):
+        """只识别图片中的一个窗口，窗口不大于max_size时按原始分辨率输入网络(宽高取32的倍数)，
+        远处的小物体不会因为整张图缩小而丢失
+
+        Parameters
+        -----------
+        * frame: numpy array
+            - BGR图像
+        * window: tuple
+            - 窗口(left, top, width, height)，原图坐标
+        * seq: int
+            - 帧序号
+        * max_size: int
+            - 网络输入的最大宽高，窗口更大时缩小输入
+
+        Return
+        -----------
+        * Detections:
+            - 识别结果，矩形框已经换算成原图坐标
+        """
+        left, top, width, height = [int(v) for v in window]
+        crop = frame[top:top + height, left:left + width]
+        size = (min(-(-width // 32) * 32, max_size), min(-(-height // 32) * 32, max_size))
+        detections = self.detect_blob(self.make_blob(crop, size), crop, seq)
+        detections.records['x'] += left
+        detections.records['y'] += top
+        return detections
+
+    def detect_blob(self, blob, frame, seq=-1):
+        """用已经做好的网络输入识别，几个网络输入尺寸相同时可以共用一个blob
+
+        Parameters
+        -----------
+        * blob: numpy array
+            - make_blob的返回值，1 x 3 x 高 x 宽
+        * frame: numpy array
+            - 做blob用的原图，用来换算矩形框的坐标
+        * seq: int
+            - 帧序号
+
+        Return
+        -----------
+        * Detections:
+            - 识别结果
+        """
+        with self.checkout() as net:
+            net.setInput(blob)
+            # Runs the forward pass to get output of the output layers
+            outs = net.forward(self.outNames)
+        return self._decode(outs, frame, seq)
+
+    def _decode(self, outs, frame, seq=-1):
+        """从网络输出中筛选出物体
+        """
+        frameHeight = frame.shape[0]
+        frameWidth = frame.shape[1]
+        # Scan through all the bounding boxes output from the network and keep only the
+        # ones with high confidence scores. Assign the box's class label as the class with the highest score.
+        classIds, confidences, boxes = filter_outputs(outs, frameWidth, frameHeight, self.confThreshold)
+        # Perform non maximum suppression to eliminate redundant overlapping boxes with
+        # lower confidences.
+        keep = nms_indices(boxes, confidences, self.confThreshold, self.nmsThreshold)
+        return Detections.from_arrays(classIds[keep], confidences[keep], boxes[keep], self.classes, seq)
+
+    def find_objects_batch(self, frames, seqs=None):
+        """一次前向计算识别多张图片中的物体，比逐张调用detect每张图片的平均耗时更少
+
+        Parameters
+        -----------
+        * frames: list
+            - BGR图像(numpy array)或帧(Frame、FrameLoan)的列表，图片大小可以不同
+        * seqs: list
+            - 每张图片的帧序号，None时使用帧的seq
+
+        Return
+        -----------
+        * list:
+            - 每张图片的识别结果(Detections)
+        """
+        if not len(frames):
+            return []
+        if seqs is None:
+            seqs = [getattr(frame, 'seq', -1) for frame in frames]
+        images = [frame if isinstance(frame, np.ndarray) else frame.image for frame in frames]
+        blob = cv2.dnn.blobFromImages(images, 1 / 255, (self.inpWidth, self.inpHeight), [0, 0, 0], 1, crop=False)
+        with self.checkout() as net:
+            net.setInput(blob)
+            outs = net.forward(self.outNames)
+        return [self._decode(out, image, seq)
+                for out, image, seq in zip(split_outputs(outs, len(images)), images, seqs)]
+
+    def sweep(self, car, camera, poses, settle=2.0, stop=None):
+        """转动相机舵机，依次在每个角度拍一张照片，全部拍完后一次批量识别
+
+        Parameters
+        -----------
+        * car: Car
+            - 小车，用来转动相机舵机
+        * camera: Camera
+            - 相机
+        * poses: list
+            - (垂直角度, 水平角度)的列表
+        * settle: float
+            - 转动舵机后的图像稳定时间(秒)
+        * stop: function
+            - 每个角度拍照前调用，返回True时停止拍照，只识别已经拍到的图片
+
+        Return
+        -----------
+        * list:
+            - 按poses的顺序，每一项为((垂直角度, 水平角度), 图像, Detections)
+        """
+        taken = []
+        pictures = []
+        vertical = None
+        for pose in poses:
+            if stop is not None and stop():
+                break
+            if pose[0] != vertical:
+                vertical = pose[0]
+                car.turn_servo_camera_vertical(vertical)
+            car.turn_servo_camera_horizental(pose[1])
+            time.sleep(settle)  # 图像稳定时间
+            picture = camera.take_picture()
+            if picture is None:
+                break
+            taken.append(pose)
+            pictures.append(picture)
+        return list(zip(taken, pictures, self.find_objects_batch(pictures)))
 
     def drawPred(self, frame, classId, conf, left, top, right, bottom):
         """绘制框
@@ -94,13 +973,15 @@ class Ai:
         top = max(top, labelSize[1])
         cv2.putText(frame, label, (left, top), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255))
 
-    def postprocess(self, frame):
-        """搜素框
+    def postprocess(self, frame, outs):
+        """从网络输出中搜索框；只识别，不在图上绘制，需要显示时用annotate
 
         Parameters
         -----------
         * frame: numpy array
             - 图像矩阵数据
+        * outs: list
+            - 调用者自己对这张图运行net.forward(ai.outNames)得到的输出
 
         Return
         -----------
@@ -109,46 +990,40 @@ class Ai:
         * list:
             - 识别到所有物体的名称
         """
-        self.frameHeight = frame.shape[0]
-        self.frameWidth = frame.shape[1]
+        return self._decode(outs, frame).to_lists()
 
-        classIds = []
-        confidences = []
-        boxes = []
-        # Scan through all the bounding boxes output from the network and keep only the
-        # ones with high confidence scores. Assign the box's class label as the class with the highest score.
-        for out in self.outs:
-            for detection in out:
-                scores = detection[5:]
-                classId = np.argmax(scores)
-                confidence = scores[classId]
-                if confidence > self.confThreshold:
-                    center_x = detection[0] * self.frameWidth
-                    center_y = detection[1] * self.frameHeight
-                    width = detection[2] * self.frameWidth
-                    height = detection[3] * self.frameHeight
-                    left = center_x - width / 2
-                    top = center_y - height / 2
-                    classIds.append(classId)
-                    confidences.append(float(confidence))
-                    boxes.append([left, top, width, height])
-        # Perform non maximum suppression to eliminate redundant overlapping boxes with
-        # lower confidences.
-        retbox = []
-        retIds = []
-
-        indices = cv2.dnn.NMSBoxes(boxes, confidences, self.confThreshold, self.nmsThreshold)
-        for i in indices:
-            i = i[0]
-            box = boxes[i]
-            left = box[0]
-            top = box[1]
-            width = box[2]
-            height = box[3]
-            self.drawPred(frame, classIds[i], confidences[i], left, top, left + width, top + height)
-            retbox.append([(left + width / 2), (top + height / 2)])
-            retIds.append(self.classes[classIds[i]])
-        return retbox, retIds
+    def draw(self, frame, detections):
+        """在图上画出识别结果
+
+        Parameters
+        -----------
+        * frame: numpy array
+            - 图像，直接在上面绘制，不要传入相机共享的图像，用annotate
+        * detections: Detections
+            - detect的返回值
+        """
+        for r in detections:
+            left, top, width, height = float(r['x']), float(r['y']), float(r['w']), float(r['h'])
+            self.drawPred(frame, int(r['class_id']), float(r['confidence']), left, top, left + width, top + height)
+
+    def annotate(self, frame, detections):
+        """在图像的拷贝上画出识别结果，原图不变，只在显示或录像时调用
+
+        Parameters
+        -----------
+        * frame: numpy array
+            - 图像
+        * detections: Detections
+            - detect的返回值
+
+        Return
+        -----------
+        * numpy array:
+            - 画好框的新图像
+        """
+        frame = frame.copy()
+        self.draw(frame, detections)
+        return frame
 
     def read_image(self, path):
         """读取一张图片
@@ -193,31 +1068,30 @@ class Ai:
         """
         return (cv2.waitKey(delay))
 
-    def find_object(self, frame):
+    def find_object(self, frame, annotate=True):
         """
         *function:find_object
         功能：从图中获取训练的物体RECT
         ________
         Parameters
         * frame: opencv.mat类型
-        输入一张Mat类型图片
+        输入一张Mat类型图片，不会被修改
+        * annotate: bool
+        是否返回画好框的图片，不显示时传False，不做任何绘制
         ————
         Returns
         -------
         * frame
-        返回绘制了画检测物体的图片
+        返回绘制了画检测物体的图片(拷贝)，annotate为False时返回输入的图片
         *names
         返回检测物体类型
         *box
         返回检测物体的RECT
         """
-        self.blob = cv2.dnn.blobFromImage(frame, 1 / 255, (self.inpWidth, self.inpHeight), [0, 0, 0], 1, crop=False)
-        # Sets the input to the network
-        self.net.setInput(self.blob)
-        # Runs the forward pass to get output of the output layers
-        self.outs = self.net.forward(self.getOutputsNames())
-        # Remove the bounding boxes with low confidence
-        box, names = self.postprocess(frame)
+        detections = self.detect(frame)
+        if annotate:
+            frame = self.annotate(frame, detections)
+        box, names = detections.to_lists()
         return frame, names, box
 
     def get_rect(self, frame):
@@ -235,48 +1109,17 @@ class Ai:
         * retId:
             - 返回检测物体类型
         """
-        self.blob = cv2.dnn.blobFromImage(frame, 1 / 255, (self.inpWidth, self.inpHeight), [0, 0, 0], 1, crop=False)
-        # Sets the input to the network
-        self.net.setInput(self.blob)
-        # Runs the forward pass to get output of the output layers
-        self.outs = self.net.forward(self.getOutputsNames())
-
-        classIds = []
-        confidences = []
-        boxes = []
-
-        self.frameHeight = frame.shape[0]
-        self.frameWidth = frame.shape[1]
-
-        for out in self.outs:
-
-            for detection in out:
-                scores = detection[5:]
-                classId = np.argmax(scores)
-                confidence = scores[classId]
-                if confidence > self.confThreshold:
-                    center_x = detection[0] * self.frameWidth
-                    center_y = detection[1] * self.frameHeight
-                    width = detection[2] * self.frameWidth
-                    height = detection[3] * self.frameHeight
-                    left = center_x - width / 2
-                    top = center_y - height / 2
-                    classIds.append(classId)
-                    confidences.append(float(confidence))
-                    boxes.append([left, top, width, height])
-        retbox = []
-        retIds = []
-        indices = cv2.dnn.NMSBoxes(boxes, confidences, self.confThreshold, self.nmsThreshold)
-        for i in indices:
-            i = i[0]
-            box = boxes[i]
-            left = box[0]
-            top = box[1]
-            width = box[2]
-            height = box[3]
-            retbox.append([(left + width / 2), (top + height / 2)])
-            retIds.append(self.classes[classIds[i]])
-        return retbox, retIds
+        return self.detect(frame).to_lists()
+
+    @staticmethod
+    def demo_startup():
+        """比较第一次新建Ai(从文件加载并预热)和之后新建Ai(使用注册表中的模型)的时间
+
+        """
+        cold = Ai()
+        warm = Ai()
+        print('cold start %.2f s, warm start %.3f s' % (cold.startup_time, warm.startup_time))
+        print(registry.stats())
 
     @staticmethod  #
     def demo_find_dog():
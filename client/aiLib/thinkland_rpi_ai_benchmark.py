@@ -0,0 +1,307 @@
+"""
+模块功能：Ai模块的性能测试。
+* bench_postprocess: 不需要yolov3.weights，按yolov3三个输出层的形状生成模拟的网络输出，比较后处理的耗时
+* bench_batch: 需要yolov3.weights，比较逐张识别和批量识别时每张图片的耗时
+* bench_pool: 需要yolov3.weights，多进程识别池的进程数和每秒识别帧数的关系
+* bench_threads: 需要yolov3.weights，多个线程同时使用一个Ai，检查结果和单线程一样
+用法(在client目录下运行，录像文件可以省略):
+    python -m aiLib.thinkland_rpi_ai_benchmark ./record.tlr
+"""
+
+import os
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+
+try:
+    from .thinkland_rpi_ai import Ai, filter_outputs, nms_indices
+    from .thinkland_rpi_ai_pool import DetectorPool
+except ImportError:
+    from thinkland_rpi_ai import Ai, filter_outputs, nms_indices
+    from thinkland_rpi_ai_pool import DetectorPool
+
+try:
+    from carLib.thinkland_rpi_camera_record import FrameRecording
+except ImportError:
+    try:
+        from client.carLib.thinkland_rpi_camera_record import FrameRecording
+    except ImportError:
+        FrameRecording = None
+
+
+def fake_outputs(size, classes=80, objects=5, seed=0):
+    """按yolov3的输出格式生成模拟数据
+
+    Parameters
+    -----------
+    * size: int
+        - 网络输入尺寸，例如188、320、416
+    * classes: int
+        - 类别数
+    * objects: int
+        - 模拟的物体个数，每个物体附近有若干个高分的框
+    * seed: int
+        - 随机数种子
+
+    Return
+    -----------
+    * list:
+        - 三个输出层，每层是N x (5 + classes)的float32矩阵
+    """
+    rng = np.random.RandomState(seed)
+    outs = []
+    for stride in (32, 16, 8):
+        grid = -(-size // stride)
+        out = rng.random_sample((grid * grid * 3, 5 + classes)).astype(np.float32)
+        out[:, 2:4] *= 0.3
+        # 真实输出中绝大多数框的分数低于阈值，只有约2%的框略高于阈值
+        out[:, 4:] *= 0.09
+        rows = rng.randint(len(out), size=len(out) // 50)
+        out[rows, 5 + rng.randint(classes, size=len(rows))] = rng.uniform(0.1, 0.3, size=len(rows))
+        outs.append(out)
+    for _ in range(objects):
+        out = outs[rng.randint(len(outs))]
+        rows = rng.randint(len(out), size=8)
+        out[rows, 5 + rng.randint(classes)] = rng.uniform(0.3, 0.9, size=len(rows))
+    return outs
+
+
+def postprocess_loop(outs, frameWidth, frameHeight, confThreshold, nmsThreshold):
+    """原来逐行循环的后处理，作为比较的基准
+    """
+    classIds = []
+    confidences = []
+    boxes = []
+    for out in outs:
+        for detection in out:
+            scores = detection[5:]
+            classId = np.argmax(scores)
+            confidence = scores[classId]
+            if confidence > confThreshold:
+                center_x = detection[0] * frameWidth
+                center_y = detection[1] * frameHeight
+                width = detection[2] * frameWidth
+                height = detection[3] * frameHeight
+                left = center_x - width / 2
+                top = center_y - height / 2
+                classIds.append(classId)
+                confidences.append(float(confidence))
+                boxes.append([left, top, width, height])
+    retbox = []
+    retIds = []
+    indices = cv2.dnn.NMSBoxes(boxes, confidences, confThreshold, nmsThreshold)
+    for i in np.asarray(indices).reshape(-1):
+        left, top, width, height = boxes[i]
+        retbox.append([(left + width / 2), (top + height / 2)])
+        retIds.append(classIds[i])
+    return retbox, retIds
+
+
+def postprocess_vectorized(outs, frameWidth, frameHeight, confThreshold, nmsThreshold):
+    """Ai.get_rect中使用的向量化后处理
+    """
+    classIds, confidences, boxes = filter_outputs(outs, frameWidth, frameHeight, confThreshold)
+    retbox = []
+    retIds = []
+    for i in nms_indices(boxes, confidences, confThreshold, nmsThreshold):
+        left, top, width, height = boxes[i].tolist()
+        retbox.append([(left + width / 2), (top + height / 2)])
+        retIds.append(classIds[i])
+    return retbox, retIds
+
+
+def _time(function, args, repeat):
+    function(*args)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(*args)
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_postprocess(sizes=(188, 320, 416), frameWidth=640, frameHeight=480,
+                      confThreshold=0.1, nmsThreshold=0.6, repeat=20):
+    """比较逐行循环和向量化后处理每一帧的耗时
+
+    Return
+    -----------
+    * list:
+        - 每个输入尺寸一项(尺寸, 框数, 循环耗时ms, 向量化耗时ms)
+    """
+    results = []
+    print('%6s %7s %10s %14s %8s' % ('size', 'rows', 'loop ms', 'vectorized ms', 'speedup'))
+    for size in sizes:
+        outs = fake_outputs(size)
+        args = (outs, frameWidth, frameHeight, confThreshold, nmsThreshold)
+        expected = postprocess_loop(*args)
+        actual = postprocess_vectorized(*args)
+        assert [int(i) for i in expected[1]] == [int(i) for i in actual[1]]
+        assert np.allclose(expected[0], actual[0], atol=1e-3)
+        loop = _time(postprocess_loop, args, repeat) * 1000
+        vectorized = _time(postprocess_vectorized, args, repeat) * 1000
+        rows = sum(len(out) for out in outs)
+        print('%6d %7d %10.2f %14.2f %7.1fx' % (size, rows, loop, vectorized, loop / vectorized))
+        results.append((size, rows, loop, vectorized))
+    return results
+
+
+def bench_batch(ai=None, batch_sizes=(1, 2, 4, 8, 16), repeat=3, image=None):
+    """比较逐张识别(Ai.detect)和批量识别(Ai.find_objects_batch)时每张图片的耗时
+
+    Parameters
+    -----------
+    * ai: Ai
+        - 使用的Ai，None时用默认模型新建一个
+    * batch_sizes: tuple
+        - 测试的批量大小
+    * repeat: int
+        - 每种批量大小重复的次数
+    * image: numpy array
+        - 测试图片，None时使用dog.jpg
+
+    Return
+    -----------
+    * list:
+        - 每个批量大小一项(批量大小, 逐张每张耗时ms, 批量每张耗时ms)
+    """
+    if ai is None:
+        ai = Ai()
+    if image is None:
+        image = cv2.imread(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dog.jpg'))
+    ai.detect(image)  # 第一次前向计算较慢，不计入结果
+    results = []
+    print('%6s %12s %12s' % ('batch', 'single ms', 'batch ms'))
+    for size in batch_sizes:
+        frames = [image] * size
+        single = _time(lambda: [ai.detect(frame) for frame in frames], (), repeat) * 1000 / size
+        batch = _time(ai.find_objects_batch, (frames,), repeat) * 1000 / size
+        print('%6d %12.1f %12.1f' % (size, single, batch))
+        results.append((size, single, batch))
+    return results
+
+
+def bench_threads(ai=None, threads=8, iterations=20, images=None):
+    """多个线程同时用一个Ai识别不同的图片，检查每个结果都和单线程识别的结果一样
+
+    Parameters
+    -----------
+    * ai: Ai
+        - 使用的Ai，None时新建一个有2个网络副本的Ai
+    * threads: int
+        - 线程数
+    * iterations: int
+        - 每个线程识别的次数
+    * images: list
+        - 测试图片，None时使用dog.jpg的几种翻转
+
+    Return
+    -----------
+    * int:
+        - 和单线程结果不一样的次数，应该为0
+    """
+    if ai is None:
+        ai = Ai(replicas=2)
+    if images is None:
+        image = cv2.imread(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dog.jpg'))
+        images = [image, cv2.flip(image, 0), cv2.flip(image, 1), cv2.flip(image, -1)]
+    expected = [ai.detect(image).records for image in images]
+    errors = []
+
+    def run(index):
+        for i in range(iterations):
+            k = (index + i) % len(images)
+            records = ai.detect(images[k]).records
+            if records.shape != expected[k].shape or not np.array_equal(records, expected[k]):
+                errors.append((index, i))
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    print('threads %d, replicas %d, %d detections in %.1f s, %d mismatches' % (
+        threads, ai.replicas, threads * iterations, elapsed, len(errors)))
+    return len(errors)
+
+
+def load_frames(path, count=200):
+    """读取测试用的图像
+
+    Parameters
+    -----------
+    * path: str
+        - Camera.start_recording录制的.tlr文件，或者cv2.VideoCapture能打开的视频文件
+    * count: int
+        - 最多读取的帧数
+
+    Return
+    -----------
+    * list:
+        - BGR图像的列表
+    """
+    frames = []
+    if path.endswith('.tlr'):
+        if FrameRecording is None:
+            raise ImportError('carLib not found, run from the client directory: python -m aiLib.thinkland_rpi_ai_benchmark')
+        recording = FrameRecording(path)
+        for i in range(min(count, len(recording))):
+            jpeg = recording[i]
+            frames.append(cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR))
+            del jpeg
+        recording.close()
+        return frames
+    capture = cv2.VideoCapture(path)
+    while len(frames) < count:
+        ok, image = capture.read()
+        if not ok:
+            break
+        frames.append(image)
+    capture.release()
+    return frames
+
+
+def bench_pool(frames, workers=(1, 2, 4), ai_factory=None, ai_kwargs=None):
+    """多进程识别池的进程数和每秒识别帧数的关系
+
+    Parameters
+    -----------
+    * frames: list
+        - 测试图像
+    * workers: tuple
+        - 测试的进程数
+    * ai_factory: function
+        - 见DetectorPool
+    * ai_kwargs: dict
+        - 见DetectorPool
+
+    Return
+    -----------
+    * list:
+        - 每个进程数一项(进程数, 每秒帧数, 启动时间秒)
+    """
+    results = []
+    slot_size = max(frame.nbytes for frame in frames)
+    print('%8s %10s %12s' % ('workers', 'fps', 'startup s'))
+    for count in workers:
+        with DetectorPool(count, slot_size=slot_size, ai_factory=ai_factory, ai_kwargs=ai_kwargs) as pool:
+            start = time.perf_counter()
+            for _ in pool.map(frames):
+                pass
+            fps = len(frames) / (time.perf_counter() - start)
+            print('%8d %10.1f %12.1f' % (count, fps, pool.startup_time))
+            results.append((count, fps, pool.startup_time))
+    return results
+
+
+if __name__ == "__main__":
+    bench_postprocess()
+    if os.path.exists(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'coco/yolov3.weights')):
+        bench_batch()
+        bench_threads()
+        if len(sys.argv) > 1:
+            bench_pool(load_frames(sys.argv[1]), workers=range(1, (os.cpu_count() or 2) + 1))
+    else:
+        print('coco/yolov3.weights not found, skip bench_batch, bench_threads and bench_pool')
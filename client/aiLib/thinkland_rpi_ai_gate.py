@@ -0,0 +1,110 @@
+"""
+模块功能：画面不变时跳过识别。
+小车停着或者相机舵机慢慢转动时，相邻的帧几乎一样，再做一次前向计算只是浪费CPU。
+ChangeGate把每一帧缩小成很小的灰度图(默认32 x 24)，和上一次识别的帧比较平均像素差，
+差别小于threshold时直接返回上一次的识别结果，只有画面变化时才调用Ai。
+用法:
+    gate = ChangeGate(ai)
+    while True:
+        pic = camera.take_picture()
+        detections = gate.detect(pic)  # 和Ai.detect的返回值一样
+    print(gate.stats())  # hit_rate为跳过识别的比例
+"""
+
+import cv2
+import numpy as np
+
+try:
+    from .thinkland_rpi_ai import Detections
+except ImportError:
+    from thinkland_rpi_ai import Detections
+
+
+class ChangeGate:
+    """画面变化时才识别，否则重用上一次的识别结果
+    不是线程安全的，每个循环使用自己的ChangeGate
+    """
+
+    def __init__(self, ai, threshold=3.0, size=(32, 24), max_reuse=50):
+        """
+        Parameters
+        -----------
+        * ai: Ai
+            - 识别使用的Ai，也可以是TrackingDetector等有detect方法的对象
+        * threshold: float
+            - 缩小后的灰度图平均每个像素的差别(0~255)，低于它认为画面没有变化
+        * size: tuple
+            - 比较用的缩略图(宽, 高)
+        * max_reuse: int
+            - 最多连续重用多少次，防止画面慢慢变化时一直不识别；None表示不限制
+        """
+        self.ai = ai
+        self.threshold = threshold
+        self.size = size
+        self.max_reuse = max_reuse
+        self._thumb = None  # 上一次识别的帧的缩略图
+        self._detections = None  # 上一次的识别结果
+        self._reused = 0
+        self.hits = 0  # 重用识别结果的帧数
+        self.misses = 0  # 调用Ai识别的帧数
+        self.last_diff = 0.0  # 最近一帧和上一次识别的帧的差别
+
+    def thumbnail(self, image):
+        """缩小成比较用的灰度图(float32)
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def detect(self, frame, seq=None):
+        """画面变化时识别，否则返回上一次的结果，用法和Ai.detect一样
+
+        Parameters
+        -----------
+        * frame: numpy array or Frame
+            - BGR图像，也可以是Camera.take_frame返回的帧或borrow_picture返回的FrameLoan
+        * seq: int
+            - 帧序号，None时使用frame.seq，没有时为-1
+
+        Return
+        -----------
+        * Detections:
+            - 识别结果，重用时帧序号换成这一帧的
+        """
+        if seq is None:
+            seq = getattr(frame, 'seq', -1)
+        image = frame if isinstance(frame, np.ndarray) else frame.image
+        thumb = self.thumbnail(image)
+        if self._thumb is not None and (self.max_reuse is None or self._reused < self.max_reuse):
+            self.last_diff = float(np.mean(np.abs(thumb - self._thumb)))
+            if self.last_diff < self.threshold:
+                self._reused += 1
+                self.hits += 1
+                records = self._detections.records.copy()
+                records['seq'] = seq
+                return Detections(records)
+        detections = self.ai.detect(image, seq)
+        self._thumb = thumb
+        self._detections = detections
+        self._reused = 0
+        self.misses += 1
+        return detections
+
+    def reset(self):
+        """丢弃上一次的结果，下一帧一定识别
+        """
+        self._thumb = None
+        self._detections = None
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - hits: 重用识别结果的帧数
+            - misses: 调用Ai识别的帧数
+            - hit_rate: 重用的比例
+            - last_diff: 最近一帧的差别
+        """
+        frames = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / frames if frames else 0.0,
+                'last_diff': self.last_diff}
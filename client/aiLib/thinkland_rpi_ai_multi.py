@@ -0,0 +1,207 @@
+"""
+模块功能：一个进程中同时运行多个模型。
+coco模型(aiLib/coco)和自己训练的巡线模型(aiLib/line)各自新建Ai时，每一帧要缩放、归一化两次。
+MultiAi管理多个Ai，每一帧对每个不同的网络输入尺寸只做一次blob，输入尺寸相同的模型共用；
+模型可以依次运行，也可以在线程中同时运行(cv2.dnn前向计算时释放GIL)。
+configure/set_model可以在运行中替换模型，没有改变的模型不会重新加载。
+用法:
+    multi = MultiAi(MODELS)
+    results = multi.detect(pic)  # {'coco': Detections, 'line': Detections}
+    print(results['coco'].names, results['line'].best('line'))
+"""
+
+import collections
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from .thinkland_rpi_ai import Ai, registry
+except ImportError:
+    from thinkland_rpi_ai import Ai, registry
+
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 包中自带的两个模型，line.weights需要自己训练后放到aiLib/line中
+MODELS = collections.OrderedDict([
+    ('coco', {'classes': os.path.join(_HERE, 'coco/coco.names'),
+              'config': os.path.join(_HERE, 'coco/yolov3.cfg'),
+              'weights': os.path.join(_HERE, 'coco/yolov3.weights')}),
+    ('line', {'classes': os.path.join(_HERE, 'line/line.names'),
+              'config': os.path.join(_HERE, 'line/line.cfg'),
+              'weights': os.path.join(_HERE, 'line/line.weights')}),
+])
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _files(spec):
+    """模型用到的文件和修改时间，文件改变(例如重新训练)后需要重新加载
+    """
+    paths = [os.path.abspath(spec[key]) for key in ('classes', 'config', 'weights')]
+    return tuple((path, _mtime(path)) for path in paths) + (spec.get('replicas', 1),)
+
+
+class MultiAi:
+    """多个模型共用预处理，依次或同时识别同一帧
+    """
+
+    def __init__(self, models=None, parallel=False):
+        """
+        Parameters
+        -----------
+        * models: dict
+            - 模型名 -> {'classes', 'config', 'weights'}，可选'replicas'、'size'(输入尺寸)、
+              'confThreshold'、'nmsThreshold'、'settings'(thinkland_rpi_ai_tuner的json文件)；
+              None表示MODELS
+        * parallel: bool
+            - 是否在线程中同时运行各个模型
+        """
+        self._lock = threading.Lock()
+        self._models = collections.OrderedDict()  # 模型名 -> (文件, Ai)
+        self.parallel = parallel
+        self._executor = None
+        self.configure(MODELS if models is None else models)
+
+    @property
+    def names(self):
+        """所有模型名
+        """
+        with self._lock:
+            return list(self._models)
+
+    def __getitem__(self, name):
+        """模型名对应的Ai
+        """
+        with self._lock:
+            return self._models[name][1]
+
+    def set_model(self, name, spec):
+        """添加或替换一个模型，文件没有改变时不重新加载，只按spec重新设置输入尺寸和阈值
+        (spec中删掉的项恢复成默认值)
+
+        Parameters
+        -----------
+        * name: str
+            - 模型名
+        * spec: dict
+            - 见__init__的models
+
+        Return
+        -----------
+        * Ai:
+            - 模型名对应的Ai
+        """
+        files = _files(spec)
+        with self._lock:
+            current = self._models.get(name)
+        if current is not None and current[0] == files:
+            ai = current[1]
+            ai.reset_settings()
+            if spec.get('settings') is not None:
+                ai.load_settings(spec['settings'])
+        else:
+            if current is not None and [f[0] for f in current[0][1:3]] == [f[0] for f in files[1:3]] \
+                    and current[0][1:3] != files[1:3]:
+                # 同一个路径的cfg或weights被修改(例如重新训练)，注册表中还是旧的网络
+                registry.unload(spec['config'], spec['weights'])
+            ai = Ai(spec['classes'], spec['config'], spec['weights'], spec.get('replicas', 1),
+                    spec.get('settings'))
+        if 'size' in spec:
+            ai.inpWidth = ai.inpHeight = spec['size']
+        if 'confThreshold' in spec:
+            ai.confThreshold = spec['confThreshold']
+        if 'nmsThreshold' in spec:
+            ai.nmsThreshold = spec['nmsThreshold']
+        with self._lock:
+            self._models[name] = (files, ai)
+            old = None if current is None or current[1] is ai else current[1]
+        if old is not None:
+            self._release(old)
+        return ai
+
+    def remove_model(self, name):
+        """删除一个模型，正在进行的识别不受影响
+        """
+        with self._lock:
+            _, ai = self._models.pop(name)
+        self._release(ai)
+
+    def configure(self, models):
+        """把模型换成models：新的加载，改变的替换，没有改变的保留，不再需要的删除
+
+        Parameters
+        -----------
+        * models: dict
+            - 见__init__
+        """
+        for name in [name for name in self.names if name not in models]:
+            self.remove_model(name)
+        for name, spec in models.items():
+            self.set_model(name, spec)
+
+    def _release(self, ai):
+        """没有其他模型使用时，把网络从注册表中删除，释放内存
+        """
+        key = registry.key(ai.modelConfiguration, ai.modelWeights)
+        with self._lock:
+            used = any(registry.key(other.modelConfiguration, other.modelWeights) == key
+                       for _, other in self._models.values())
+        if not used:
+            registry.unload(ai.modelConfiguration, ai.modelWeights)
+
+    def detect(self, frame, seq=None, names=None):
+        """所有模型识别同一帧，每个不同的输入尺寸只做一次blob
+
+        Parameters
+        -----------
+        * frame: numpy array or Frame
+            - BGR图像，也可以是Camera.take_frame返回的帧或borrow_picture返回的FrameLoan
+        * seq: int
+            - 帧序号，None时使用frame.seq，没有时为-1
+        * names: list
+            - 只运行这些模型，None表示全部
+
+        Return
+        -----------
+        * OrderedDict:
+            - 模型名 -> Detections
+        """
+        if seq is None:
+            seq = getattr(frame, 'seq', -1)
+        image = frame if isinstance(frame, np.ndarray) else frame.image
+        with self._lock:
+            models = [(name, ai) for name, (_, ai) in self._models.items() if names is None or name in names]
+        blobs = {}
+        for _, ai in models:
+            size = (ai.inpWidth, ai.inpHeight)
+            if size not in blobs:
+                blobs[size] = ai.make_blob(image, size)
+        jobs = [(name, ai, blobs[(ai.inpWidth, ai.inpHeight)]) for name, ai in models]
+        if self.parallel and len(jobs) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(len(jobs), thread_name_prefix='multi-ai')
+            futures = [(name, self._executor.submit(ai.detect_blob, blob, image, seq)) for name, ai, blob in jobs]
+            return collections.OrderedDict((name, future.result()) for name, future in futures)
+        return collections.OrderedDict((name, ai.detect_blob(blob, image, seq)) for name, ai, blob in jobs)
+
+    def close(self):
+        """停止同时运行用的线程
+        """
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
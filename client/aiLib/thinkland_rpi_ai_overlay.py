@@ -0,0 +1,81 @@
+"""
+模块功能：识别结果的显示层。
+控制循环只需要识别结果，不需要在图上画框。Overlay保存最近一次的识别结果，控制循环识别后调用update
+(只保存引用，几乎没有开销)；显示或录像的线程需要画面时才调用overlay(image)，在图像的拷贝上画框，
+相机共享的图像不会被修改。
+用法:
+    overlay = Overlay(ai)
+    threading.Thread(target=camera.play, args=(overlay,)).start()  # 显示线程按需画框
+    while True:
+        with camera.borrow_picture() as pic:
+            detections = ai.detect(pic)
+        overlay.update(detections)
+"""
+
+import threading
+import time
+
+
+class Overlay:
+    """最近一次的识别结果，显示时画在图像的拷贝上，可以在多个线程中使用
+    """
+
+    def __init__(self, ai, max_age=1.0):
+        """
+        Parameters
+        -----------
+        * ai: Ai
+            - 用它的annotate画框(类别名称来自ai.classes)
+        * max_age: float
+            - 识别结果超过多少秒不再显示，None表示一直显示
+        """
+        self.ai = ai
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._detections = None
+        self._time = 0.0
+        self.rendered = 0  # 画框的次数
+
+    def update(self, detections):
+        """保存最新的识别结果，不做任何绘制
+
+        Parameters
+        -----------
+        * detections: Detections
+            - 识别结果
+        """
+        with self._lock:
+            self._detections = detections
+            self._time = time.time()
+
+    def latest(self):
+        """
+        Return
+        -----------
+        * Detections or None:
+            - 还在max_age以内的识别结果，没有时返回None
+        """
+        with self._lock:
+            detections, updated = self._detections, self._time
+        if detections is None or (self.max_age is not None and time.time() - updated > self.max_age):
+            return None
+        return detections
+
+    def __call__(self, image):
+        """在图像的拷贝上画出最近的识别结果
+
+        Parameters
+        -----------
+        * image: numpy array
+            - 要显示的图像，不会被修改
+
+        Return
+        -----------
+        * numpy array:
+            - 画好框的图像，没有识别结果时返回原图像
+        """
+        detections = self.latest()
+        if detections is None or not len(detections):
+            return image
+        self.rendered += 1
+        return self.ai.annotate(image, detections)
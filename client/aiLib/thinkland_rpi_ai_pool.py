@@ -0,0 +1,278 @@
+"""
+模块功能：多进程识别池。
+一个python进程中的cv2.dnn用不满多核电脑的CPU，后处理又受GIL限制。DetectorPool启动多个进程，
+每个进程只加载一次网络；图片通过共享内存的槽传给子进程，不需要pickle整张图片，
+只有很小的识别结果通过队列返回，map()按提交的顺序返回结果。
+提示：共享内存需要python3.8以上；子进程用spawn方式启动，使用DetectorPool的脚本要放在
+if __name__ == "__main__": 之后运行
+用法:
+    with DetectorPool(workers=4) as pool:
+        for detections in pool.map(frames):
+            print(detections.names)
+"""
+
+import collections
+import multiprocessing
+import os
+import queue
+import time
+
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python3.8以下没有shared_memory
+    shared_memory = None
+
+try:
+    from .thinkland_rpi_ai import Ai, Detections
+except ImportError:
+    from thinkland_rpi_ai import Ai, Detections
+
+
+def _worker(name, slot_size, tasks, results, ai_factory, ai_kwargs):
+    """子进程：加载一次网络，然后不断从共享内存的槽中取图片识别
+    """
+    # 子进程和创建者共用同一个resource_tracker，共享内存由创建者在close时删除
+    shm = shared_memory.SharedMemory(name)
+    start = time.time()
+    try:
+        ai = ai_factory(**ai_kwargs)
+    except Exception as e:
+        shm.close()
+        results.put(('error', os.getpid(), repr(e)))
+        return
+    results.put(('ready', os.getpid(), time.time() - start))
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            job, slot, shape, seq = task
+            # 进程意外退出时，父进程据此知道哪个任务不会再有结果
+            results.put(('start', os.getpid(), job))
+            image = np.ndarray(shape, np.uint8, buffer=shm.buf, offset=slot * slot_size)
+            try:
+                records = ai.detect(image, seq).records
+                results.put((job, records, None))
+            except Exception as e:
+                results.put((job, None, repr(e)))
+            del image
+    finally:
+        shm.close()
+
+
+class DetectorPool:
+    """多进程识别池，每个进程一个网络，图片通过共享内存传递
+    不是线程安全的，只能在一个线程中提交和取结果
+    """
+
+    def __init__(self, workers=None, slots=None, slot_size=640 * 480 * 3, ai_factory=None, ai_kwargs=None):
+        """
+        Parameters
+        -----------
+        * workers: int
+            - 进程数，None表示CPU核数减一
+        * slots: int
+            - 共享内存的槽数，也就是最多同时在识别的图片数，None表示进程数的两倍
+        * slot_size: int
+            - 每个槽的字节数，要能放下一张图片(高 x 宽 x 3)
+        * ai_factory: function
+            - 在子进程中创建Ai的函数，要能被pickle(模块级的函数或类)，None表示Ai
+        * ai_kwargs: dict
+            - 传给ai_factory的参数，例如{'classes': ..., 'config': ..., 'weights': ...}
+        """
+        if shared_memory is None:
+            raise RuntimeError('detector pool needs python3.8 or later')
+        self.workers = workers or max((os.cpu_count() or 2) - 1, 1)
+        self.slots = slots or 2 * self.workers
+        self.slot_size = slot_size
+        context = multiprocessing.get_context('spawn')
+        self._shm = shared_memory.SharedMemory(create=True, size=self.slots * slot_size)
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._free = list(range(self.slots))
+        self._pending = {}  # 任务号 -> 槽
+        self._started = {}  # 任务号 -> 正在识别它的进程号
+        self._done = {}  # 任务号 -> Detections或异常
+        self._next_job = 0
+        self.completed = 0
+        start = time.time()
+        self._processes = [context.Process(target=_worker, daemon=True,
+                                           args=(self._shm.name, slot_size, self._tasks, self._results,
+                                                 ai_factory or Ai, ai_kwargs or {}))
+                           for _ in range(self.workers)]
+        self.load_times = []  # 每个进程加载网络的时间(秒)
+        try:
+            for process in self._processes:
+                process.start()
+            while len(self.load_times) < self.workers:
+                self._collect()
+        except BaseException:
+            self.close()
+            raise
+        self.startup_time = time.time() - start  # 所有进程启动并加载完网络的时间(秒)
+        self._start_time = time.time()
+
+    def _collect(self):
+        """等待一个子进程的消息；子进程意外退出时，它没有完成的任务以RuntimeError结束
+        """
+        while True:
+            try:
+                job, records, error = self._results.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if self._check_processes():
+                    return
+        if job == 'ready':
+            self.load_times.append(error)
+        elif job == 'error':
+            raise RuntimeError('detector process %d failed to load: %s' % (records, error))
+        elif job == 'start':
+            if error in self._pending:
+                self._started[error] = records
+        else:
+            self._finish(job, Detections(records) if error is None else RuntimeError(error))
+
+    def _finish(self, job, result):
+        self._started.pop(job, None)
+        self._free.append(self._pending.pop(job))
+        self._done[job] = result
+        self.completed += 1
+
+    def _check_processes(self):
+        """检查退出的子进程
+
+        Return
+        -----------
+        * bool:
+            - 是否有任务因为子进程退出而结束
+        """
+        dead = {process.pid: process.exitcode for process in self._processes if process.exitcode is not None}
+        if not dead:
+            return False
+        if len(dead) == len(self._processes):
+            # 所有进程都退出了，排队中的任务也不会再有结果
+            failed = list(self._pending)
+        else:
+            failed = [job for job, pid in self._started.items() if pid in dead]
+        for job in failed:
+            pid = self._started.get(job)
+            if pid is None:
+                message = 'all detector processes exited'
+            else:
+                message = 'detector process %d exited with code %d' % (pid, dead[pid])
+            self._finish(job, RuntimeError(message))
+        if failed:
+            return True
+        if len(dead) == len(self._processes) or len(self.load_times) < self.workers:
+            raise RuntimeError('detector process exited with code %d' % next(iter(dead.values())))
+        return False
+
+    def submit(self, frame, seq=None):
+        """提交一张图片，没有空闲的槽时等待
+
+        Parameters
+        -----------
+        * frame: numpy array or Frame
+            - BGR图像(uint8)，或者带image属性的帧，函数返回后就可以修改或释放
+        * seq: int
+            - 帧序号，None时使用frame.seq，没有时为-1
+
+        Return
+        -----------
+        * int:
+            - 任务号，用get取结果
+        """
+        if seq is None:
+            seq = getattr(frame, 'seq', -1)
+        image = frame if isinstance(frame, np.ndarray) else frame.image
+        if image.nbytes > self.slot_size:
+            raise ValueError('image of %d bytes does not fit slot_size %d' % (image.nbytes, self.slot_size))
+        while not self._free:
+            self._collect()
+        slot = self._free.pop()
+        view = np.ndarray(image.shape, np.uint8, buffer=self._shm.buf, offset=slot * self.slot_size)
+        view[...] = image
+        del view
+        job = self._next_job
+        self._next_job += 1
+        self._pending[job] = slot
+        self._tasks.put((job, slot, image.shape, seq))
+        return job
+
+    def get(self, job):
+        """等待任务的识别结果
+
+        Return
+        -----------
+        * Detections:
+            - 识别结果
+        """
+        if job not in self._pending and job not in self._done:
+            raise KeyError('unknown job %r' % (job,))
+        while job not in self._done:
+            self._collect()
+        result = self._done.pop(job)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def map(self, frames):
+        """识别一系列图片，多个进程同时识别，按图片的顺序返回结果
+
+        Parameters
+        -----------
+        * frames: iterable
+            - 图像或帧，可以是生成器
+
+        Return
+        -----------
+        * generator:
+            - 每张图片的识别结果(Detections)，顺序和frames一样
+        """
+        jobs = collections.deque()
+        for frame in frames:
+            if not self._free and jobs:
+                yield self.get(jobs.popleft())
+            jobs.append(self.submit(frame))
+        while jobs:
+            yield self.get(jobs.popleft())
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - workers: 进程数
+            - in_flight: 正在识别的图片数
+            - completed: 完成的图片数
+            - fps: 平均每秒识别的图片数
+            - startup_time: 启动用的时间(秒)
+        """
+        elapsed = max(time.time() - self._start_time, 1e-6)
+        return {'workers': self.workers, 'in_flight': len(self._pending), 'completed': self.completed,
+                'fps': self.completed / elapsed, 'startup_time': self.startup_time}
+
+    def close(self):
+        """停止所有进程，删除共享内存
+        """
+        if self._shm is None:
+            return
+        for _ in self._processes:
+            self._tasks.put(None)
+        for process in self._processes:
+            if process.pid is None:
+                continue
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
@@ -0,0 +1,227 @@
+"""
+模块功能：后台识别服务。
+Ai的一次前向计算要几百毫秒，直接在控制循环里调用时，这段时间小车无法响应传感器。
+DetectionService在单独的线程里运行Ai，控制循环提交图片后立即返回，继续读取传感器，
+识别结果通过Future、回调函数或者latest()取得，结果中带有图片的帧序号。
+排队的请求最多maxsize个，满了以后丢弃最旧的请求(只识别最新的图片)。
+用法:
+    service = DetectionService(Ai())
+    while True:
+        frame = camera.take_frame()
+        service.submit(frame)
+        detections = service.latest()  # 不等待，返回最近一次的识别结果
+        ...  # 读取超声波、红外传感器
+"""
+
+import collections
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class _Request:
+    """一个识别请求
+    """
+    __slots__ = ('frame', 'seq', 'future', 'submitted')
+
+    def __init__(self, frame, seq, future):
+        self.frame = frame
+        self.seq = seq
+        self.future = future
+        self.submitted = time.time()
+
+    def finish(self):
+        """归还借用的帧(FrameLoan)
+        """
+        if getattr(self.frame, 'frame', None) is not None and hasattr(self.frame, 'release'):
+            self.frame.release()
+        self.frame = None
+
+
+class DetectionService:
+    """在后台线程中运行Ai的识别服务，排队满时丢弃旧请求
+    """
+
+    def __init__(self, ai, maxsize=1, name='detection'):
+        """
+        Parameters
+        -----------
+        * ai: Ai
+            - 识别使用的Ai；Ai的detect可以在多个线程中同时调用，服务运行时其他线程也可以使用它，
+              网络副本(replicas)不够时会互相等待
+        * maxsize: int
+            - 最多排队的请求数，满了以后丢弃最旧的请求
+        * name: str
+            - 线程名
+        """
+        assert maxsize >= 1
+        self.ai = ai
+        self.maxsize = maxsize
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._busy = False
+        self._latest = None
+        self._infer_times = collections.deque(maxlen=100)
+        self._latencies = collections.deque(maxlen=100)
+        self.submitted = 0  # 提交的请求数
+        self.completed = 0  # 完成识别的请求数
+        self.dropped = 0  # 排队时被新请求挤掉的请求数
+        self.failed = 0  # 识别出错的请求数
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, seq=None, callback=None):
+        """提交一张图片，立即返回
+
+        Parameters
+        -----------
+        * frame: numpy array, Frame or FrameLoan
+            - 图像或者帧。numpy array在识别完之前不要修改；
+              Camera.borrow_picture借来的FrameLoan由服务在识别完或丢弃后归还
+        * seq: int
+            - 帧序号，None时使用frame.seq，没有时为-1
+        * callback: function
+            - 识别完成或请求被丢弃时在后台线程中调用，参数为Future
+
+        Return
+        -----------
+        * Future:
+            - future.seq为帧序号，future.result()为识别结果(Detections)；
+              请求被丢弃时future.cancelled()为True
+        """
+        if seq is None:
+            seq = getattr(frame, 'seq', -1)
+        future = Future()
+        future.seq = seq
+        if callback is not None:
+            future.add_done_callback(callback)
+        request = _Request(frame, seq, future)
+        dropped = []
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('detection service is closed')
+            self._queue.append(request)
+            self.submitted += 1
+            while len(self._queue) > self.maxsize:
+                dropped.append(self._queue.popleft())
+                self.dropped += 1
+            self._cond.notify()
+        for old in dropped:
+            old.finish()
+            old.future.cancel()
+        return future
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+                request = self._queue.popleft()
+                self._busy = True
+            if not request.future.set_running_or_notify_cancel():
+                request.finish()
+                continue
+            start = time.time()
+            try:
+                frame = request.frame
+                image = frame if isinstance(frame, np.ndarray) else frame.image
+                detections = self.ai.detect(image, request.seq)
+            except Exception as e:
+                with self._cond:
+                    self.failed += 1
+                    self._busy = False
+                request.finish()
+                request.future.set_exception(e)
+                continue
+            end = time.time()
+            request.finish()
+            with self._cond:
+                self.completed += 1
+                self._busy = False
+                self._infer_times.append(end - start)
+                self._latencies.append(end - request.submitted)
+                if self._latest is None or request.seq >= self._latest[0]:
+                    self._latest = (request.seq, detections)
+            request.future.set_result(detections)
+
+    def latest(self):
+        """最近一次的识别结果，不等待
+
+        Return
+        -----------
+        * Detections or None:
+            - 帧序号最大的识别结果，还没有结果时返回None
+        """
+        with self._cond:
+            return None if self._latest is None else self._latest[1]
+
+    def detect(self, frame, seq=None, timeout=None):
+        """提交并等待结果，和Ai.detect用法一样
+
+        Return
+        -----------
+        * Detections or None:
+            - 识别结果，请求被丢弃时返回None
+        """
+        future = self.submit(frame, seq)
+        try:
+            return future.result(timeout)
+        except Exception:
+            if future.cancelled():
+                return None
+            raise
+
+    def qsize(self):
+        """排队中的请求数
+        """
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - submitted/completed/dropped/failed: 请求数
+            - queued: 排队中的请求数
+            - busy: 是否正在识别
+            - drop_rate: 被丢弃的请求比例
+            - infer_ms: 最近识别的平均耗时(毫秒)
+            - latency_ms: 最近从提交到完成的平均时间(毫秒)
+        """
+        with self._cond:
+            stats = {'submitted': self.submitted, 'completed': self.completed, 'dropped': self.dropped,
+                     'failed': self.failed, 'queued': len(self._queue), 'busy': self._busy}
+            stats['drop_rate'] = self.dropped / self.submitted if self.submitted else 0.0
+            stats['infer_ms'] = float(np.mean(self._infer_times)) * 1000 if self._infer_times else 0.0
+            stats['latency_ms'] = float(np.mean(self._latencies)) * 1000 if self._latencies else 0.0
+        return stats
+
+    def close(self, wait=True):
+        """停止服务，排队中的请求被取消
+
+        Parameters
+        -----------
+        * wait: bool
+            - 是否等待正在进行的识别完成
+        """
+        with self._cond:
+            self._closed = True
+            pending = list(self._queue)
+            self._queue.clear()
+            self._cond.notify_all()
+        for request in pending:
+            request.finish()
+            request.future.cancel()
+        if wait:
+            self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
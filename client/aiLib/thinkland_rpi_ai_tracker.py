@@ -0,0 +1,204 @@
+"""
+模块功能：识别加跟踪。
+YOLO每一帧都要做一次完整的前向计算，而相邻两帧之间目标几乎不动。TrackingDetector用Ai识别一次后，
+在每个物体的框内取角点，之后的帧用金字塔光流(cv2.calcOpticalFlowPyrLK)把角点和框移动到新的位置，
+每帧只需要几毫秒。每隔interval帧，或者跟踪的置信度(仍能可靠跟踪的角点比例)低于min_confidence时，
+再用Ai重新识别。Ai设置了跟随窗口(set_roi)时，只跟踪的帧也更新窗口的位置，
+下一次识别的窗口跟着物体移动。
+用法:
+    tracker = TrackingDetector(ai, interval=10, names='cup')
+    while True:
+        loan = camera.borrow_picture()
+        with loan as pic:
+            detections = tracker.detect(pic, loan.seq)  # 和Ai.detect的返回值一样
+        print(detections.best('cup'), tracker.stats())
+"""
+
+import time
+
+import cv2
+import numpy as np
+
+try:
+    from .thinkland_rpi_ai import Detections
+except ImportError:
+    from thinkland_rpi_ai import Detections
+
+
+class TrackingDetector:
+    """在Ai外面加一层光流跟踪，只在需要时才运行YOLO
+    不是线程安全的，每个控制循环使用自己的TrackingDetector
+    """
+
+    def __init__(self, ai, interval=10, min_confidence=0.5, names=None, scale=0.5, max_points=40):
+        """
+        Parameters
+        -----------
+        * ai: Ai
+            - 识别使用的Ai
+        * interval: int
+            - 最多每隔多少帧用Ai重新识别一次
+        * min_confidence: float
+            - 有物体的跟踪置信度低于它时立即重新识别
+        * names: str or list
+            - 只跟踪这些物体，None表示跟踪识别到的所有物体
+        * scale: float
+            - 跟踪时把图像缩小的比例，越小越快
+        * max_points: int
+            - 每个物体最多跟踪的角点数
+        """
+        self.ai = ai
+        self.interval = interval
+        self.min_confidence = min_confidence
+        self.names = names
+        self.scale = scale
+        self.max_points = max_points
+        self._prev = None  # 上一帧缩小后的灰度图
+        self._records = None  # 跟踪中的物体
+        self._points = []  # 每个物体的角点(缩小后的坐标)
+        self._initial = []  # 每个物体识别时的角点数
+        self.confidences = np.empty(0)  # 每个物体的跟踪置信度
+        self._since_detect = 0
+        self.detected = 0  # 用Ai识别的帧数
+        self.tracked = 0  # 只跟踪的帧数
+        self._detect_time = 0.0
+        self._track_time = 0.0
+
+    def _gray(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        if self.scale != 1:
+            gray = cv2.resize(gray, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        return gray
+
+    def _init_points(self, gray, records):
+        """在每个物体的框内取角点
+        """
+        self._points = []
+        height, width = gray.shape
+        for r in records:
+            left = int(np.clip(r['x'] * self.scale, 0, width - 1))
+            top = int(np.clip(r['y'] * self.scale, 0, height - 1))
+            right = int(np.clip((r['x'] + r['w']) * self.scale, left + 1, width))
+            bottom = int(np.clip((r['y'] + r['h']) * self.scale, top + 1, height))
+            # 只在框内的区域中找角点，不用整帧大小的mask
+            points = cv2.goodFeaturesToTrack(gray[top:bottom, left:right], self.max_points, 0.01, 3)
+            if points is not None:
+                points = points.reshape(-1, 2) + np.array([left, top], np.float32)
+            if points is None or len(points) < 4:
+                # 没有纹理的物体用框内均匀的网格点
+                xs, ys = np.meshgrid(np.linspace(left, right - 1, 5), np.linspace(top, bottom - 1, 5))
+                points = np.stack([xs.ravel(), ys.ravel()], axis=1)
+            self._points.append(np.asarray(points, np.float32).reshape(-1, 2))
+        self._initial = [len(points) for points in self._points]
+        self.confidences = np.ones(len(records))
+
+    def _track(self, gray):
+        """用光流移动所有的角点和框，前后向误差大的角点丢弃
+        """
+        counts = [len(points) for points in self._points]
+        if not sum(counts):
+            self.confidences = np.zeros(len(self._points))
+            return
+        points = np.concatenate(self._points).reshape(-1, 1, 2)
+        params = dict(winSize=(15, 15), maxLevel=3,
+                      criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._prev, gray, points, None, **params)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev, moved, None, **params)
+        error = np.linalg.norm((points - back).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < 1.0)
+        points = points.reshape(-1, 2)
+        moved = moved.reshape(-1, 2)
+        records = self._records
+        start = 0
+        for i, count in enumerate(counts):
+            end = start + count
+            old, new = points[start:end][good[start:end]], moved[start:end][good[start:end]]
+            start = end
+            self._points[i] = new
+            self.confidences[i] = len(new) / max(self._initial[i], 1)
+            if len(new) < 3:
+                self.confidences[i] = 0.0
+                continue
+            # 框的平移取角点位移的中位数，缩放取角点间距离之比的中位数
+            shift = np.median(new - old, axis=0) / self.scale
+            zoom = 1.0
+            if len(new) >= 2:
+                d_old = np.linalg.norm(old[:, None] - old[None], axis=2)
+                d_new = np.linalg.norm(new[:, None] - new[None], axis=2)
+                valid = d_old > 1.0
+                if valid.any():
+                    zoom = float(np.median(d_new[valid] / d_old[valid]))
+            r = records[i]
+            cx = r['x'] + r['w'] / 2 + shift[0]
+            cy = r['y'] + r['h'] / 2 + shift[1]
+            r['w'] *= zoom
+            r['h'] *= zoom
+            r['x'] = cx - r['w'] / 2
+            r['y'] = cy - r['h'] / 2
+
+    def detect(self, frame, seq=None):
+        """识别或跟踪一帧，用法和Ai.detect一样
+
+        Parameters
+        -----------
+        * frame: numpy array or Frame
+            - BGR图像，也可以是Camera.take_frame返回的帧或borrow_picture返回的FrameLoan
+        * seq: int
+            - 帧序号，None时使用frame.seq，没有时为-1
+
+        Return
+        -----------
+        * Detections:
+            - 识别结果，只跟踪的帧中物体的框是光流移动后的位置
+        """
+        if seq is None:
+            seq = getattr(frame, 'seq', -1)
+        image = frame if isinstance(frame, np.ndarray) else frame.image
+        start = time.time()
+        gray = self._gray(image)
+        if self._records is not None and len(self._records) and self._since_detect < self.interval - 1:
+            self._track(gray)
+            if self.confidences.min() >= self.min_confidence:
+                self._prev = gray
+                self._since_detect += 1
+                self.tracked += 1
+                self._records['seq'] = seq
+                detections = Detections(self._records.copy())
+                roi = getattr(self.ai, 'roi', None)
+                if roi is not None:
+                    roi.track(detections)
+                self._track_time += time.time() - start
+                return detections
+        detections = self.ai.detect(image, seq)
+        if self.names is not None:
+            detections = detections.filter(self.names)
+        self._records = detections.records.copy()
+        self._init_points(gray, self._records)
+        self._prev = gray
+        self._since_detect = 0
+        self.detected += 1
+        self._detect_time += time.time() - start
+        return detections
+
+    def reset(self):
+        """丢弃跟踪中的物体，下一帧重新识别，例如小车大幅度转向之后
+        """
+        self._records = None
+        self._prev = None
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - detected: 用Ai识别的帧数
+            - tracked: 只跟踪的帧数
+            - detect_ms: 识别帧的平均耗时(毫秒)
+            - track_ms: 跟踪帧的平均耗时(毫秒)
+            - frame_ms: 所有帧的平均耗时(毫秒)
+        """
+        frames = self.detected + self.tracked
+        return {'detected': self.detected, 'tracked': self.tracked,
+                'detect_ms': self._detect_time * 1000 / self.detected if self.detected else 0.0,
+                'track_ms': self._track_time * 1000 / self.tracked if self.tracked else 0.0,
+                'frame_ms': (self._detect_time + self._track_time) * 1000 / frames if frames else 0.0}
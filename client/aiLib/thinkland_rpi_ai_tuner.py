@@ -0,0 +1,347 @@
+"""
+模块功能：离线调整Ai的输入尺寸和阈值。
+用train_tool中标注好的图片，测试不同的输入尺寸(inpWidth/inpHeight)、confThreshold和nmsThreshold
+的识别耗时和准确度(precision/recall/F1，IoU>=0.5算识别正确)，把帕累托最优的设置(没有其他设置
+既更快又更准)写入json文件，Ai(settings='ai_settings.json')即可使用。
+* 每个输入尺寸只做一次前向计算，不同阈值只重新做后处理
+* 不同的输入尺寸的准确度在多个进程中同时测试；耗时在主进程中逐个尺寸单独测量，
+  和小车上只运行一个Ai时一样使用cv2默认的线程数
+标注文件支持两种格式，和图片同名(.txt)：
+* train_tool/main.py生成的格式: 第一行为物体个数，之后每行"xmin ymin xmax ymax"(像素)
+* yolo格式: 每行"类别 中心x 中心y 宽 高"(相对图片大小)
+用法(在client目录下运行):
+    python -m aiLib.thinkland_rpi_ai_tuner ../train_tool/Images/002 ../train_tool/Labels/002 dog
+"""
+
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+try:
+    from .thinkland_rpi_ai import Ai, filter_outputs, nms_indices
+except ImportError:
+    from thinkland_rpi_ai import Ai, filter_outputs, nms_indices
+
+
+SIZES = tuple(range(128, 417, 32))
+CONF_THRESHOLDS = (0.05, 0.1, 0.2, 0.3, 0.4, 0.5)
+NMS_THRESHOLDS = (0.4, 0.5, 0.6)
+LATENCY_IMAGES = 10  # 测量耗时用的图片数
+
+
+def read_labels(path):
+    """读取一个标注文件
+
+    Return
+    -----------
+    * tuple:
+        - ('pixel', N x 4的[xmin, ymin, xmax, ymax])或('yolo', N x 4的[中心x, 中心y, 宽, 高])
+    """
+    with open(path, 'rt') as f:
+        lines = [line.split() for line in f.read().split('\n') if line.strip()]
+    if lines and len(lines[0]) == 1:
+        return 'pixel', np.array([[float(v) for v in line[:4]] for line in lines[1:] if len(line) >= 4],
+                                 np.float64).reshape(-1, 4)
+    return 'yolo', np.array([[float(v) for v in line[1:5]] for line in lines if len(line) >= 5],
+                            np.float64).reshape(-1, 4)
+
+
+def load_dataset(images, labels=None, name=None, limit=None):
+    """读取标注好的图片列表
+
+    Parameters
+    -----------
+    * images: str
+        - 图片目录，例如train_tool/Images/002
+    * labels: str
+        - 标注目录，例如train_tool/Labels/002，None表示标注文件和图片在同一个目录
+    * name: str
+        - 标注的物体在Ai.classes中的名称，例如'dog'
+    * limit: int
+        - 最多读取的图片数
+
+    Return
+    -----------
+    * list:
+        - 每张图片一项(图片路径, 物体名称, 标注)
+    """
+    samples = []
+    for path in sorted(glob.glob(os.path.join(images, '*.jpg'))):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        label = os.path.join(labels or images, stem + '.txt')
+        if not os.path.exists(label):
+            continue
+        samples.append((path, name, read_labels(label)))
+        if limit is not None and len(samples) >= limit:
+            break
+    return samples
+
+
+def to_corners(labels, width, height):
+    """标注转换成像素坐标的[xmin, ymin, xmax, ymax]
+    """
+    kind, boxes = labels
+    if kind == 'pixel':
+        return boxes
+    scale = np.array([width, height, width, height], np.float64)
+    boxes = boxes * scale
+    return np.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2], axis=1)
+
+
+def match_boxes(boxes, confidences, truth, iou=0.5):
+    """按置信度从高到低把识别结果和标注一一对应
+
+    Parameters
+    -----------
+    * boxes: numpy array
+        - 识别结果，N x 4的[left, top, width, height]
+    * confidences: numpy array
+        - 识别结果的置信度
+    * truth: numpy array
+        - 标注，M x 4的[xmin, ymin, xmax, ymax]
+    * iou: float
+        - 交并比不低于iou时算识别正确
+
+    Return
+    -----------
+    * tuple:
+        - (识别正确数, 误识别数, 漏识别数)
+    """
+    if not len(boxes) or not len(truth):
+        return 0, len(boxes), len(truth)
+    boxes = boxes[np.argsort(-confidences, kind='stable')]
+    corners = np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1)
+    left = np.maximum(corners[:, None, 0], truth[None, :, 0])
+    top = np.maximum(corners[:, None, 1], truth[None, :, 1])
+    right = np.minimum(corners[:, None, 2], truth[None, :, 2])
+    bottom = np.minimum(corners[:, None, 3], truth[None, :, 3])
+    inter = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    area = (boxes[:, 2] * boxes[:, 3])[:, None] + \
+        ((truth[:, 2] - truth[:, 0]) * (truth[:, 3] - truth[:, 1]))[None, :]
+    overlap = inter / np.maximum(area - inter, 1e-9)
+    used = np.zeros(len(truth), bool)
+    tp = 0
+    for row in overlap:
+        row = np.where(used, -1.0, row)
+        best = int(np.argmax(row))
+        if row[best] >= iou:
+            used[best] = True
+            tp += 1
+    return tp, len(boxes) - tp, len(truth) - tp
+
+
+_ai = None  # 子进程中的Ai
+
+
+def _init_worker(ai_kwargs, threads):
+    global _ai
+    cv2.setNumThreads(threads)
+    _ai = Ai(**ai_kwargs)
+
+
+def _forward(ai, image):
+    blob = ai.make_blob(image)
+    with ai.checkout() as net:
+        net.setInput(blob)
+        return net.forward(ai.outNames)
+
+
+def _evaluate_size(size, samples, conf_thresholds, nms_thresholds, iou):
+    """在子进程中测试一个输入尺寸的准确度
+
+    Return
+    -----------
+    * tuple:
+        - (输入尺寸, 每组阈值的[识别正确数, 误识别数, 漏识别数])
+    """
+    ai = _ai
+    ai.inpWidth = ai.inpHeight = size
+    counts = np.zeros((len(conf_thresholds), len(nms_thresholds), 3), np.int64)
+    for path, name, labels in samples:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        height, width = image.shape[:2]
+        truth = to_corners(labels, width, height)
+        outs = _forward(ai, image)
+        for i, conf in enumerate(conf_thresholds):
+            classIds, confidences, boxes = filter_outputs(outs, width, height, conf)
+            target = np.array([ai.classes[c] == name for c in classIds], bool)
+            for j, nms in enumerate(nms_thresholds):
+                keep = nms_indices(boxes, confidences, conf, nms)
+                keep = keep[target[keep]]
+                counts[i, j] += match_boxes(boxes[keep], confidences[keep], truth, iou)
+    return size, counts
+
+
+def measure_latency(ai, size, images):
+    """单独测量一个输入尺寸每张图片的耗时(blob和前向计算)，不能和其他测试同时运行
+
+    Parameters
+    -----------
+    * ai: Ai
+        - 测试的Ai
+    * size: int
+        - 输入尺寸
+    * images: list
+        - 测试用的图像
+
+    Return
+    -----------
+    * float:
+        - 中位耗时(秒)
+    """
+    ai.inpWidth = ai.inpHeight = size
+    if not images:
+        return 0.0
+    _forward(ai, images[0])  # 预热，第一次前向计算要分配内存
+    times = []
+    for image in images:
+        start = time.perf_counter()
+        _forward(ai, image)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def pareto(results):
+    """帕累托最优的设置：按耗时从小到大，只保留F1比所有更快的设置都高的
+
+    Parameters
+    -----------
+    * results: list
+        - tune返回的所有设置
+
+    Return
+    -----------
+    * list:
+        - 帕累托最优的设置，按耗时从小到大
+    """
+    front = []
+    for result in sorted(results, key=lambda r: (r['latency_ms'], -r['f1'])):
+        if not front or result['f1'] > front[-1]['f1']:
+            front.append(result)
+    return front
+
+
+def tune(samples, sizes=SIZES, conf_thresholds=CONF_THRESHOLDS, nms_thresholds=NMS_THRESHOLDS,
+         iou=0.5, workers=None, ai_kwargs=None):
+    """测试所有的输入尺寸和阈值组合
+
+    Parameters
+    -----------
+    * samples: list
+        - load_dataset的返回值，可以是多个目录的和
+    * sizes: tuple
+        - 测试的输入尺寸
+    * conf_thresholds: tuple
+        - 测试的confThreshold
+    * nms_thresholds: tuple
+        - 测试的nmsThreshold
+    * iou: float
+        - 交并比不低于iou时算识别正确
+    * workers: int
+        - 测试准确度的进程数，None表示4、CPU核数和尺寸数中最小的一个
+    * ai_kwargs: dict
+        - 新建Ai的参数
+
+    Return
+    -----------
+    * list:
+        - 每个组合一项{'size', 'confThreshold', 'nmsThreshold', 'latency_ms', 'precision', 'recall', 'f1'}
+    """
+    ai_kwargs = ai_kwargs or {}
+    cpus = os.cpu_count() or 1
+    # 每个进程都要加载一份网络，树莓派的内存只够几个
+    workers = workers or min(4, cpus, len(sizes))
+    # 平分CPU核，避免多个进程的cv2线程互相抢占
+    threads = max(cpus // workers, 1)
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(ai_kwargs, threads)) as executor:
+        futures = [executor.submit(_evaluate_size, size, samples, conf_thresholds, nms_thresholds, iou)
+                   for size in sizes]
+        accuracy = [future.result() for future in futures]
+    # 耗时在准确度测试结束后逐个尺寸单独测量，不受其他进程影响
+    ai = Ai(**ai_kwargs)
+    images = [image for image in (cv2.imread(path) for path, _, _ in samples[:LATENCY_IMAGES])
+              if image is not None]
+    results = []
+    for size, counts in accuracy:
+        latency = measure_latency(ai, size, images)
+        print('size %d: %.1f ms' % (size, latency * 1000))
+        for i, conf in enumerate(conf_thresholds):
+            for j, nms in enumerate(nms_thresholds):
+                tp, fp, fn = counts[i, j].tolist()
+                precision = tp / (tp + fp) if tp + fp else 0.0
+                recall = tp / (tp + fn) if tp + fn else 0.0
+                f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+                results.append({'size': size, 'confThreshold': conf, 'nmsThreshold': nms,
+                                'latency_ms': latency * 1000, 'precision': precision, 'recall': recall,
+                                'f1': f1})
+    return results
+
+
+def save_settings(results, path, budget_ms=None):
+    """把帕累托最优的设置写入json文件
+
+    Parameters
+    -----------
+    * results: list
+        - tune的返回值
+    * path: str
+        - json文件路径
+    * budget_ms: float
+        - 默认选用的设置的最大耗时(毫秒)，None表示选F1最高的
+
+    Return
+    -----------
+    * dict:
+        - 写入的内容{'pareto': [...], 'selected': {...}}
+    """
+    front = pareto(results)
+    selected = select_settings(front, budget_ms)
+    settings = {'pareto': front, 'selected': selected}
+    with open(path, 'w') as f:
+        json.dump(settings, f, indent=2)
+    return settings
+
+
+def select_settings(front, budget_ms=None):
+    """在帕累托最优的设置中选择耗时不超过budget_ms且F1最高的一个，都超过时选最快的
+
+    Return
+    -----------
+    * dict or None:
+        - 选中的设置
+    """
+    if not front:
+        return None
+    within = [r for r in front if budget_ms is None or r['latency_ms'] <= budget_ms]
+    if not within:
+        return front[0]
+    return max(within, key=lambda r: r['f1'])
+
+
+def main(args):
+    if len(args) < 3:
+        print('usage: python -m aiLib.thinkland_rpi_ai_tuner <images> <labels or -> <name> [output.json]')
+        return
+    images, labels, name = args[:3]
+    output = args[3] if len(args) > 3 else os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                       'ai_settings.json')
+    samples = load_dataset(images, None if labels == '-' else labels, name)
+    print('%d labeled images' % len(samples))
+    settings = save_settings(tune(samples), output)
+    for r in settings['pareto']:
+        print('size %(size)d conf %(confThreshold).2f nms %(nmsThreshold).2f: %(latency_ms).1f ms, '
+              'precision %(precision).2f recall %(recall).2f f1 %(f1).2f' % r)
+    print('selected:', settings['selected'])
+    print('saved to', output)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -20,14 +20,14 @@ class Algrithm():
         功能：对图像进行二值化
         ________
         Parameters
-        * image: opencv.mat类型
+        * image: opencv.mat类型，彩色图或灰度图
         * thre: 图像阀值
         ————
         Returns
         -------
         * binary 二进制图像
         """
-        gray = cv.cvtColor(image, cv.COLOR_RGB2GRAY)
+        gray = image if image.ndim == 2 else cv.cvtColor(image, cv.COLOR_RGB2GRAY)
         ret, binary = cv.threshold(gray, thre, 250, cv.THRESH_BINARY_INV)
         if self.__DEBUG:
             cv.imshow('binary',binary)
@@ -41,13 +41,13 @@ class Algrithm():
         功能：对图像进行二值化 ，采用局部值域
         ________
         Parameters2
-        * image: opencv.mat类型
+        * image: opencv.mat类型，彩色图或灰度图
         ————
         Returns
         -------
         * None
         """
-        gray = cv.cvtColor(image, cv.COLOR_RGB2GRAY)
+        gray = image if image.ndim == 2 else cv.cvtColor(image, cv.COLOR_RGB2GRAY)
         binary =  cv.adaptiveThreshold(gray, 255, cv.ADAPTIVE_THRESH_GAUSSIAN_C,cv.THRESH_BINARY, 25, 10)
 
     def line(self ,img ,thre=60, areaLimit=1000):
@@ -56,7 +56,7 @@ class Algrithm():
         功能：从头图像中提取一条线
         ________
         Parameters
-        * image: opencv.mat类型
+        * image: opencv.mat类型，可以直接传入灰度图（camera.take_picture(profile='gray')），省去解码彩色和转换的开销
         ————
         Returns
         -------
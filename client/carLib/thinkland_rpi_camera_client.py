@@ -8,21 +8,664 @@
 """
 # Todo: 改进图像更新方式
 
+import collections
+import gc
 import threading
+import traceback
+import zlib
 import cv2
-import urllib
-import urllib.request
 import numpy as np
 import time
 
+try:
+    import resource
+except ImportError:  # windows没有resource模块
+    resource = None
+
+try:
+    from .thinkland_rpi_camera_source import MjpegHttpSource, MjpegFileSource, RecordingSource, SyntheticSource
+    from .thinkland_rpi_camera_record import FrameRecorder
+except ImportError:
+    from thinkland_rpi_camera_source import MjpegHttpSource, MjpegFileSource, RecordingSource, SyntheticSource
+    from thinkland_rpi_camera_record import FrameRecorder
+
 
 __authors__ = 'xiao long & xu lao shi'
 __version__ = 'version 0.02'
 __license__ = 'Copyright...'
 
 
+# 解码配置：利用libjpeg在DCT域直接缩小和只解亮度通道，用多少像素就解多少像素
+DECODE_PROFILES = {
+    'full': cv2.IMREAD_COLOR,  # 原尺寸BGR
+    'half': cv2.IMREAD_REDUCED_COLOR_2,  # 1/2尺寸BGR
+    'quarter': cv2.IMREAD_REDUCED_COLOR_4,  # 1/4尺寸BGR
+    'eighth': cv2.IMREAD_REDUCED_COLOR_8,  # 1/8尺寸BGR
+    'gray': cv2.IMREAD_GRAYSCALE,  # 原尺寸灰度
+    'gray_half': cv2.IMREAD_REDUCED_GRAYSCALE_2,  # 1/2尺寸灰度
+    'gray_quarter': cv2.IMREAD_REDUCED_GRAYSCALE_4,  # 1/4尺寸灰度
+}
+
+# 每种解码配置的缩小倍数
+_PROFILE_SCALES = {'full': 1, 'half': 2, 'quarter': 4, 'eighth': 8, 'gray': 1, 'gray_half': 2, 'gray_quarter': 4}
+
+
+def convert_image(image, profile):
+    """把已经解码的原尺寸BGR图像转换为指定的解码配置，用于没有jpeg数据的帧
+
+    Parameters
+    -----------
+    * image: numpy array
+        - 原尺寸BGR图像
+    * profile: str
+        - DECODE_PROFILES中的配置名
+
+    Return
+    -----------
+    * numpy array:
+        - 转换后的图像
+    """
+    scale = _PROFILE_SCALES[profile]
+    if scale != 1:
+        image = cv2.resize(image, (image.shape[1] // scale, image.shape[0] // scale),
+                           interpolation=cv2.INTER_AREA)
+    if profile.startswith('gray'):
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    return image
+
+
+def decode_jpeg(jpg, flags=cv2.IMREAD_COLOR):
+    """把jpeg数据解码为图像
+
+    Parameters
+    -----------
+    * jpg: bytes
+        - jpeg数据
+    * flags: int
+        - cv2.imdecode的解码参数
+
+    Return
+    -----------
+    * numpy array:
+        - 解码后的图像
+    """
+    return cv2.imdecode(np.frombuffer(jpg, dtype=np.uint8), flags)
+
+
+class DecodeStats:
+    """解码统计，用来查看延迟解码节省了多少CPU
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.received = 0  # 收到的jpeg帧数
+        self.decoded = 0  # 至少解码过一次的帧数
+        self.decodes = 0  # 解码总次数，一帧按多种配置解码时会多于decoded
+        self.decode_time = 0.0  # 解码总耗时(秒)
+
+    def add_received(self):
+        with self._lock:
+            self.received += 1
+
+    def add_decoded(self, seconds, first=True):
+        with self._lock:
+            if first:
+                self.decoded += 1
+            self.decodes += 1
+            self.decode_time += seconds
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - received: 收到的帧数
+            - decoded: 实际解码的帧数
+            - decodes: 解码总次数
+            - skipped: 没有被读取、跳过解码的帧数
+            - decode_time: 解码总耗时(秒)
+            - saved_time: 按平均解码耗时估算节省的时间(秒)
+        """
+        with self._lock:
+            skipped = max(self.received - self.decoded, 0)
+            average = self.decode_time / self.decodes if self.decodes else 0.0
+            return {'received': self.received, 'decoded': self.decoded, 'decodes': self.decodes,
+                    'skipped': skipped,
+                    'decode_time': self.decode_time, 'saved_time': skipped * average}
+
+
+class FramePool:
+    """检查借用图像是否被修改的解码缓冲池，只用于调试
+    每种图像尺寸最多保留size块缓冲区，帧被替换并且所有借用者都归还后，缓冲区回到池中重复使用。
+    借出的图像是可写的，借出和归还时各计算一次校验和，内容被修改时打印借出时的调用栈，
+    用来找出在借用的图像上直接绘制的代码。
+    注意：cv2.imdecode的python接口不能指定输出，每次解码仍然分配一次内存，缓冲池还要多拷贝一次整帧，
+    实测(SyntheticSource 640x480)峰值内存和gc次数和不用缓冲池时一样，不能用来减少内存分配
+    """
+
+    def __init__(self, size=4):
+        """
+        Parameters
+        -----------
+        * size: int
+            - 每种尺寸最多保留的缓冲区个数
+        """
+        self.size = size
+        self._lock = threading.Lock()
+        self._free = {}  # (shape, dtype) -> 空闲缓冲区列表
+        self._counts = {}  # (shape, dtype) -> 已分配的缓冲区个数
+        self._owned = {}  # 属于缓冲池的缓冲区，id -> 缓冲区
+        self.allocated = 0  # 分配的缓冲区个数
+        self.reused = 0  # 重复使用的次数
+        self.exhausted = 0  # 缓冲池用完，临时分配的次数
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.violations = 0  # 发现的修改次数
+
+    def take(self, shape, dtype=np.uint8):
+        """取出一块缓冲区
+
+        Parameters
+        -----------
+        * shape: tuple
+            - 图像尺寸
+        * dtype: numpy dtype
+            - 数据类型
+
+        Return
+        -----------
+        * numpy array:
+            - 缓冲区，内容未初始化
+        """
+        key = (tuple(shape), np.dtype(dtype).str)
+        with self._lock:
+            free = self._free.setdefault(key, [])
+            if free:
+                buffer = free.pop()
+                self.reused += 1
+            else:
+                buffer = np.empty(shape, dtype)
+                if self._counts.get(key, 0) < self.size:
+                    self._counts[key] = self._counts.get(key, 0) + 1
+                    self._owned[id(buffer)] = buffer
+                    self.allocated += 1
+                else:
+                    self.exhausted += 1
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+        return buffer
+
+    def give(self, buffer):
+        """归还缓冲区，不属于缓冲池的临时缓冲区直接丢弃
+        """
+        key = (tuple(buffer.shape), buffer.dtype.str)
+        with self._lock:
+            self.in_use -= 1
+            if self._owned.get(id(buffer)) is buffer:
+                self._free.setdefault(key, []).append(buffer)
+
+    def report_violation(self, seq, stack):
+        """发现借用者修改了图像
+        """
+        with self._lock:
+            self.violations += 1
+        print('frame %d was modified while borrowed, checked out at:\n%s' % (seq, ''.join(stack)))
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - 分配次数、重复使用次数、用完次数、正在使用和峰值个数、发现的修改次数，
+              以及gc计数和进程峰值内存(KB，仅unix)
+        """
+        with self._lock:
+            result = {'allocated': self.allocated, 'reused': self.reused, 'exhausted': self.exhausted,
+                      'in_use': self.in_use, 'peak_in_use': self.peak_in_use, 'violations': self.violations}
+        result['gc_count'] = gc.get_count()
+        if resource is not None:
+            result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return result
+
+
+class FrameLoan:
+    """借用的一帧图像，用完必须调用release归还，也可以用with语句自动归还
+    借用期间图像不会被回收，也不会被复制
+    """
+
+    def __init__(self, frame, profile='full', readonly=False):
+        """
+        Parameters
+        -----------
+        * frame: Frame
+            - 已经增加了引用(retain)的帧，归还时减少引用
+        * profile: str
+            - 解码配置
+        * readonly: bool
+            - 为True时借出只读的图像，修改时在写入处抛出异常；
+              使用缓冲池时忽略，借出可写的图像，归还时用校验和检查并报告借出的位置
+        """
+        self.frame = frame
+        self.seq = frame.seq
+        self.timestamp = frame.timestamp
+        self._image = frame.decode(profile, pooled=True)
+        self._checksum = None
+        self._stack = None
+        pool = frame.pool
+        if pool is not None:
+            self._checksum = zlib.crc32(self._image.data if self._image.flags.c_contiguous
+                                        else self._image.tobytes())
+            self._stack = traceback.format_stack(limit=6)[:-1]
+            # 可写的图像才能让修改发生，由归还时的校验发现
+            readonly = False
+        if readonly:
+            self._image = self._image.view()
+            self._image.flags.writeable = False
+
+    @property
+    def image(self):
+        """借用的图像，只能读取，不能修改
+        """
+        return self._image
+
+    def release(self):
+        """归还图像
+        """
+        if self.frame is None:
+            return
+        if self._checksum is not None:
+            image = self._image
+            checksum = zlib.crc32(image.data if image.flags.c_contiguous else image.tobytes())
+            if checksum != self._checksum:
+                self.frame.pool.report_violation(self.seq, self._stack)
+        self.frame.release()
+        self.frame = None
+        self._image = None
+
+    def __enter__(self):
+        return self._image
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.release()
+
+
+class Frame:
+    """一帧图像及其序号、接收时间
+    接收线程只保存压缩的jpeg数据，第一次读取image时才解码，
+    解码结果按解码配置缓存在帧里，所有读取这一帧的线程共享同一个结果
+    """
+
+    def __init__(self, seq, timestamp, jpeg=None, image=None, stats=None, pool=None):
+        """
+        Parameters
+        -----------
+        * seq: int
+            - 帧序号，从1开始单调递增
+        * timestamp: float
+            - 接收到该帧的时间(time.time())
+        * jpeg: bytes
+            - 压缩的jpeg数据
+        * image: numpy array
+            - 已经解码的图像，提供时不再解码
+        * stats: DecodeStats
+            - 解码统计
+        * pool: FramePool
+            - 解码缓冲池，None表示每次解码都重新分配
+        """
+        self.seq = seq
+        self.timestamp = timestamp
+        self.jpeg = jpeg
+        self.pool = pool
+        self._images = {} if image is None else {'full': image}
+        self._pooled = []  # 从缓冲池取出的缓冲区
+        self.decode_spans = {}  # 解码配置 -> (开始时间, 结束时间)，用于延迟跟踪
+        self._refs = 1  # 邮箱持有一个引用
+        self._stats = stats
+        self._lock = threading.Lock()
+
+    def retain(self):
+        """增加一个引用，引用归零前解码缓冲区不会被回收
+        """
+        with self._lock:
+            self._refs += 1
+
+    def release(self):
+        """减少一个引用，归零时把解码缓冲区还给缓冲池
+        """
+        with self._lock:
+            self._refs -= 1
+            if self._refs > 0 or not self._pooled:
+                return
+            pooled = self._pooled
+            self._pooled = []
+            self._images = {}
+        for buffer in pooled:
+            self.pool.give(buffer)
+
+    @property
+    def image(self):
+        """原尺寸BGR图像，第一次访问时解码
+        """
+        return self.decode('full')
+
+    def decode(self, profile='full', pooled=False):
+        """按解码配置获取图像，每种配置只解码一次
+
+        Parameters
+        -----------
+        * profile: str
+            - 'full'、'half'、'quarter'、'eighth'、'gray'、'gray_half'、'gray_quarter'
+        * pooled: bool
+            - 调用者持有帧的引用(retain)，直到用完图像才release时为True，可以拿到缓冲池中的图像；
+              为False时缓冲池中的图像随时可能被回收，返回一份拷贝
+
+        Return
+        -----------
+        * numpy array:
+            - 图像数据
+        """
+        if self.pool is None:
+            # 没有缓冲池时解码结果不会被回收，不加锁直接读取
+            image = self._images.get(profile)
+            if image is not None:
+                return image
+        if profile not in DECODE_PROFILES:
+            raise ValueError('unknown decode profile: %s' % profile)
+        with self._lock:
+            image = self._images.get(profile)
+            if image is None:
+                start = time.time()
+                first = not self._images
+                if self.jpeg is not None:
+                    image = decode_jpeg(self.jpeg, DECODE_PROFILES[profile])
+                else:
+                    image = convert_image(self._images['full'], profile)
+                if pooled and self.pool is not None and self._refs > 0:
+                    # cv2.imdecode的python接口不能指定输出，临时结果拷贝到池中缓冲区后立即释放
+                    buffer = self.pool.take(image.shape, image.dtype)
+                    np.copyto(buffer, image)
+                    image = buffer
+                    self._pooled.append(buffer)
+                end = time.time()
+                if self._stats is not None:
+                    self._stats.add_decoded(end - start, first)
+                self.decode_spans[profile] = (start, end)
+                self._images[profile] = image
+            if pooled or not any(buffer is image for buffer in self._pooled):
+                return image
+            # 拷贝期间持有一个引用，缓冲区不会被还给缓冲池
+            self._refs += 1
+        try:
+            return image.copy()
+        finally:
+            self.release()
+
+
+class FrameMailbox:
+    """线程安全的最新帧邮箱
+    只保存最新的一帧，消费者可以阻塞等待比自己上一次拿到的更新的帧，
+    不需要sleep轮询，也不会重复拿到同一帧
+    """
+
+    def __init__(self, pool=None):
+        """
+        Parameters
+        -----------
+        * pool: FramePool
+            - 解码缓冲池，None表示不使用缓冲池
+        """
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._closed = False
+        self.pool = pool
+        self.decode_stats = DecodeStats()
+
+    @property
+    def seq(self):
+        """最新一帧的序号，0表示还没有收到图像
+        """
+        return self._seq
+
+    def put(self, jpeg=None, image=None, timestamp=None):
+        """放入一帧新图像，唤醒所有等待者
+
+        Parameters
+        -----------
+        * jpeg: bytes
+            - 压缩的jpeg数据，读取时才解码
+        * image: numpy array
+            - 已经解码的图像数据
+        * timestamp: float
+            - 接收时间，默认为当前时间
+
+        Return
+        -----------
+        * Frame:
+            - 放入的帧
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._cond:
+            self._seq += 1
+            old = self._frame
+            self._frame = frame = Frame(self._seq, timestamp, jpeg, image, self.decode_stats, self.pool)
+            if jpeg is not None:
+                self.decode_stats.add_received()
+            self._cond.notify_all()
+        if old is not None:
+            old.release()
+        return frame
+
+    def latest(self):
+        """返回最新的一帧，没有图像时返回None
+        """
+        return self._frame
+
+    def close(self):
+        """不会再有新的帧，唤醒所有等待者
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def wait_for_new_frame(self, after_seq=0, timeout=None, retain=False):
+        """阻塞等待序号大于after_seq的帧
+
+        Parameters
+        -----------
+        * after_seq: int
+            - 已经处理过的帧序号
+        * timeout: float
+            - 最长等待时间(秒)，None表示一直等待
+        * retain: bool
+            - 为True时给帧增加一个引用，用完后需要调用frame.release()
+
+        Return
+        -----------
+        * Frame or None:
+            - 新的帧，超时或者帧源已经结束时返回None
+        """
+        with self._cond:
+            if self._cond.wait_for(lambda: self._seq > after_seq or self._closed, timeout) \
+                    and self._seq > after_seq:
+                if retain:
+                    self._frame.retain()
+                return self._frame
+            return None
+
+
+class FrameSubscriber:
+    """帧总线的订阅者，每个订阅者有自己的接收策略：
+    * 'latest': 只保留最新的一帧，处理不过来时跳过旧帧
+    * 'every': 每一帧都接收，队列满时丢弃最旧的帧
+    * 'nth': 每隔nth帧接收一帧，队列满时丢弃最旧的帧
+    拿到的图像是所有订阅者共享的解码结果，只读，不拷贝
+    """
+
+    POLICIES = ('latest', 'every', 'nth')
+
+    def __init__(self, bus, name, policy='latest', nth=1, profile='full', maxlen=8):
+        """
+        Parameters
+        -----------
+        * bus: FrameBus
+            - 所属的帧总线
+        * name: str
+            - 订阅者名字
+        * policy: str
+            - 'latest'、'every'或'nth'
+        * nth: int
+            - policy为'nth'时每隔nth帧接收一帧
+        * profile: str
+            - 解码配置，见Camera.take_picture
+        * maxlen: int
+            - 'every'和'nth'策略的队列长度
+        """
+        if policy not in self.POLICIES:
+            raise ValueError('unknown subscribe policy: %s' % policy)
+        self.bus = bus
+        self.name = name
+        self.policy = policy
+        self.nth = max(int(nth), 1)
+        self.profile = profile
+        self._queue = collections.deque()
+        self._maxlen = 1 if policy == 'latest' else max(maxlen, 1)
+        self._cond = threading.Condition()
+        self._closed = False
+        self.offered = 0  # 总线上发布的帧数
+        self.delivered = 0  # 取走的帧数
+        self.dropped = 0  # 没来得及取走而丢弃的帧数
+        self.last_seq = 0  # 最近一次取走的帧序号
+        self.latest_seq = 0  # 总线上最新的帧序号
+
+    def offer(self, frame):
+        """总线发布新帧时调用
+        """
+        dropped = None
+        with self._cond:
+            if self._closed:
+                return
+            self.offered += 1
+            self.latest_seq = frame.seq
+            if self.policy == 'nth' and frame.seq % self.nth:
+                return
+            frame.retain()
+            self._queue.append(frame)
+            if len(self._queue) > self._maxlen:
+                dropped = self._queue.popleft()
+                self.dropped += 1
+            self._cond.notify_all()
+        if dropped is not None:
+            dropped.release()
+
+    def get(self, timeout=None):
+        """取出下一帧，没有时阻塞等待
+
+        Parameters
+        -----------
+        * timeout: float
+            - 最长等待时间(秒)，None表示一直等待
+
+        Return
+        -----------
+        * FrameLoan or None:
+            - 只读的借用帧，用完要release，或者用with语句；超时或取消订阅后返回None
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._queue or self._closed, timeout) or not self._queue:
+                return None
+            frame = self._queue.popleft()
+            self.delivered += 1
+            self.last_seq = frame.seq
+        try:
+            return FrameLoan(frame, self.profile, readonly=True)
+        except Exception:
+            frame.release()
+            raise
+
+    def close(self):
+        """取消订阅，归还队列中的帧
+        """
+        with self._cond:
+            self._closed = True
+            frames = list(self._queue)
+            self._queue.clear()
+            self._cond.notify_all()
+        for frame in frames:
+            frame.release()
+        self.bus.unsubscribe(self)
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - policy: 接收策略
+            - delivered: 取走的帧数
+            - dropped: 丢弃的帧数
+            - lag: 最新帧和最近取走的帧相差的帧数
+            - queued: 队列中等待的帧数
+        """
+        with self._cond:
+            return {'policy': self.policy, 'delivered': self.delivered, 'dropped': self.dropped,
+                    'lag': self.latest_seq - self.last_seq if self.last_seq else 0,
+                    'queued': len(self._queue)}
+
+
+class FrameBus:
+    """进程内的帧总线，把每一帧发布给所有订阅者
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+
+    def subscribe(self, name, policy='latest', nth=1, profile='full', maxlen=8):
+        """增加一个订阅者，参数见FrameSubscriber
+
+        Return
+        -----------
+        * FrameSubscriber:
+            - 订阅者
+        """
+        subscriber = FrameSubscriber(self, name, policy, nth, profile, maxlen)
+        with self._lock:
+            self._subscribers = self._subscribers + [subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscriber]
+
+    def publish(self, frame):
+        """发布一帧
+        """
+        for subscriber in self._subscribers:
+            subscriber.offer(frame)
+
+    def close(self):
+        """帧源结束，唤醒所有订阅者
+        """
+        for subscriber in self._subscribers:
+            with subscriber._cond:
+                subscriber._closed = True
+                subscriber._cond.notify_all()
+
+    def stats(self):
+        """每个订阅者的统计数据
+
+        Return
+        -----------
+        * dict:
+            - 订阅者名字 -> FrameSubscriber.stats()
+        """
+        return dict((s.name, s.stats()) for s in self._subscribers)
+
+
 class HttpMixin:
     """http功能Mixin
+    默认从小车的mjpg-streamer获取视频流，也可以通过open_source换成其他帧源
     """
     url_streamer = 'http://172.16.10.227:8080/?action=streamer'
     SHOW_THREAD_FLAG = False
@@ -30,9 +673,19 @@ class HttpMixin:
     def connect_server(self, ip, port=8080):
         """连接服务器
         """
-        url = 'http://{}:{}/?action=streamer'.format(ip, port)
-        print("streamer_url", url)
-        self.stream = urllib.request.urlopen(url)
+        self.open_source(MjpegHttpSource(ip, port))
+
+    def open_source(self, source):
+        """使用指定的帧源，见thinkland_rpi_camera_source模块
+
+        Parameters
+        -----------
+        * source: FrameSource
+            - MjpegHttpSource小车视频流、MjpegFileSource录制的文件、
+              DeviceSource本机摄像头、SyntheticSource测试图像等
+        """
+        source.open()
+        self.source = source
 
     def start_receive(self):
         """开始接收数据
@@ -54,24 +707,35 @@ class HttpMixin:
     def receive_data(self):
         """接收数据
         """
-        time.sleep(2)
         print("start receive")
-        buffer = b''
-        if HttpMixin.SHOW_THREAD_FLAG:
-            cv2.namedWindow("ai", cv2.WINDOW_NORMAL);
-        while True:
-            buffer += self.stream.read(1024)
-            data_header = buffer.find(b'\xff\xd8')
-            data_end = buffer.find(b'\xff\xd9')
-            if data_header != - 1 and data_end != -1:
-                jpg = buffer[data_header:data_end + 2]
-                buffer = buffer[data_end + 2:]
-                image = cv2.imdecode(np.fromstring(jpg, dtype=np.uint8), 1)
-                if HttpMixin.SHOW_THREAD_FLAG:
-                    cv2.imshow('ai',image)
-                    cv2.waitKey(1)
-
-                self.data_handler(image)
+        window_created = False
+        for data in self.source.frames():
+            frame = self.data_handler(data)
+            if HttpMixin.SHOW_THREAD_FLAG:
+                if not window_created:
+                    cv2.namedWindow("ai", cv2.WINDOW_NORMAL)
+                    window_created = True
+                if frame is not None:
+                    image = frame.image
+                elif isinstance(data, np.ndarray):
+                    image = data
+                else:
+                    image = decode_jpeg(data)
+                cv2.imshow('ai', image)
+                cv2.waitKey(1)
+        print("receive over")
+        self.source.close()
+        self.data_finished()
+
+    def stream_stats(self):
+        """视频流接收的统计数据
+
+        Return
+        ---------
+        * dict:
+            - 帧数、每秒帧数(fps)等，http视频流还有字节数、每秒MB数(mbps)、缓冲区溢出次数
+        """
+        return self.source.stats()
 
     def data_handler(self, data):
         """处理数据
@@ -79,10 +743,17 @@ class HttpMixin:
         Parameters
         -----------
         data:
-            - 接收到的解析数据
+            - 接收到的jpeg数据(bytes)，或帧源直接产生的图像(numpy array)
         Return
         ---------
+        * Frame or None
+            - 由子类决定
+        """
+        pass
 
+    def data_finished(self):
+        """帧源没有更多数据（例如文件回放结束）
+        由子类定义具体功能
         """
         pass
 
@@ -91,40 +762,151 @@ class Camera(HttpMixin):
     """摄像机类
     """
 
-    def __init__(self):
+    def __init__(self, pool_size=0, pool_guard=False):
+        """
+        Parameters
+        -----------
+        * pool_size: int
+            - 大于0时使用检查用的解码缓冲池，每种尺寸最多保留pool_size块缓冲区，要和pool_guard一起使用；
+              缓冲池不能减少内存分配，见FramePool
+        * pool_guard: bool
+            - 检查模式，借出可写的图像，归还时检查借用者是否修改了图像，发现时打印借出的位置
+        """
+        if pool_size > 0 and not pool_guard:
+            raise ValueError('pool_size is only for checking borrowed images, use it with pool_guard=True')
         self.__Show_Flag = False
         self.ai = None
-        self._image = np.array([])
+        pool = FramePool(pool_size) if pool_size > 0 else None
+        self._mailbox = FrameMailbox(pool)
+        self._bus = FrameBus()
+        self._local = threading.local()  # 每个线程记录自己上一次拿到的帧序号
+        self._recorder = None
 
     def data_handler(self, data):
         """处理从小车摄像获取的图片
 
         Parameters
-        * data: numpy array
-            - 从小车摄像机数据
+        * data: bytes or numpy array
+            - 从小车摄像机数据，bytes为未解码的jpeg数据，只有在读取时才解码
 
         Returns
         -------
-        * None
+        * Frame
+            - 放入邮箱的帧
         """
-        self._image = data
+        if isinstance(data, np.ndarray):
+            frame = self._mailbox.put(image=data)
+        else:
+            frame = self._mailbox.put(jpeg=data)
+        self._bus.publish(frame)
+        recorder = self._recorder
+        if recorder is not None:
+            jpeg = frame.jpeg
+            if jpeg is None:  # 帧源直接产生图像时才需要编码
+                jpeg = cv2.imencode('.jpg', data)[1].tobytes()
+            recorder.write(jpeg, frame.timestamp)
+        return frame
 
-    def play(self):
-        """播放摄像头视频,可以通过ESC键关闭
+    def start_recording(self, path):
+        """开始录像，jpeg数据原样写入一个文件，不解码也不重新编码，
+        可以用thinkland_rpi_camera_record.FrameRecording读取，或用RecordingSource回放
+
+        Parameters
+        -----------
+        * path: str
+            - 录像文件路径
+        """
+        self.stop_recording()
+        self._recorder = FrameRecorder(path)
+
+    def stop_recording(self):
+        """停止录像，写入索引
+
+        Returns
+        -------
+        * int
+            - 录制的帧数
+        """
+        recorder = self._recorder
+        if recorder is None:
+            return 0
+        self._recorder = None
+        recorder.close()
+        return len(recorder)
+
+    def data_finished(self):
+        """帧源结束，等待新图像的调用立即返回None
+        """
+        self.stop_recording()
+        self._mailbox.close()
+        self._bus.close()
+
+    def decode_stats(self):
+        """解码统计，skipped为因为没有被读取而省掉的解码次数
+
+        Returns
+        -------
+        * dict
+            - 见DecodeStats.stats
         """
-        while not self._image.size:
-            time.sleep(1)
+        return self._mailbox.decode_stats.stats()
 
+    def play(self, overlay=None):
+        """播放摄像头视频,可以通过ESC键关闭
+
+        Parameters
+        -----------
+        * overlay: function
+            - 显示前调用overlay(image)，返回要显示的图像，例如画上识别结果(aiLib的Overlay)；
+              image是共享的图像，只能读取，要画图时在拷贝上画。None表示直接显示
+        """
+        subscriber = self.subscribe('display')
         while True:
+            loan = subscriber.get(timeout=0.05)
             try:
-                cv2.imshow("Camera", self._image)
+                if loan is not None:
+                    with loan as image:
+                        if overlay is not None:
+                            image = overlay(image)
+                        cv2.imshow("Camera", image)
                 k = cv2.waitKey(1)
                 if k == 27:  # wait for ESC key to exit
                     cv2.destroyAllWindows()
-                    self._image = np.array([])
                     break
             except:
                 pass
+        subscriber.close()
+
+    def subscribe(self, name, policy='latest', nth=1, profile='full', maxlen=8):
+        """订阅视频帧，多个线程各自订阅，共享同一份解码结果
+            detector = camera.subscribe('detector', policy='nth', nth=3)
+            with detector.get() as pic:
+                ai.get_rect(pic)
+
+        Parameters
+        -----------
+        * name: str
+            - 订阅者名字
+        * policy: str
+            - 'latest'只要最新帧，'every'每一帧，'nth'每隔nth帧一帧
+        * nth: int
+            - policy为'nth'时的间隔
+        * profile: str
+            - 解码配置，见take_picture
+        * maxlen: int
+            - 'every'和'nth'策略的队列长度
+
+        Returns
+        -------
+        * FrameSubscriber
+            - 订阅者，get()取帧，stats()查看延迟和丢帧，close()取消订阅
+        """
+        return self._bus.subscribe(name, policy, nth, profile, maxlen)
+
+    def bus_stats(self):
+        """所有订阅者的延迟和丢帧统计
+        """
+        return self._bus.stats()
 
     def set_ai(self, ai_yolo):
         """引入yolo类
@@ -137,22 +919,86 @@ class Camera(HttpMixin):
         """
         self.ai = ai_yolo
 
-    def take_picture(self):
+    def take_frame(self, after_seq=None, timeout=None):
+        """获取一帧比after_seq更新的图像，没有新图像时阻塞等待
+
+        Parameters
+        -----------
+        * after_seq: int
+            - 已经处理过的帧序号，None表示当前线程上一次拿到的帧序号
+        * timeout: float
+            - 最长等待时间(秒)，None表示一直等待
+
+        Returns
+        -------
+        * Frame or None
+            - 带序号(seq)和接收时间(timestamp)的帧，超时或帧源结束时返回None。
+              没有持有引用，使用缓冲池时frame.decode()返回拷贝；不想拷贝时用borrow_picture
+        """
+        if after_seq is None:
+            after_seq = getattr(self._local, 'seq', 0)
+        frame = self._mailbox.wait_for_new_frame(after_seq, timeout)
+        if frame is not None:
+            self._local.seq = frame.seq
+        return frame
+
+    def take_picture(self, timeout=None, profile='full'):
         """控制摄像机拍照
+        同一个线程连续调用时，每次都会等到一张新的图片，不会重复返回旧图片
 
         Parameters
         -----------
-        * None
+        * timeout: float
+            - 最长等待时间(秒)，None表示一直等待
+        * profile: str
+            - 解码配置，'full'原图，'half'/'quarter'/'eighth'缩小的彩色图，
+              'gray'/'gray_half'/'gray_quarter'灰度图。只用小图或灰度图时解码更快
 
         Returns
         -------
         * numpy array
-        返回一张图片
+        返回一张图片，超时或帧源结束时返回None
         """
+        after_seq = getattr(self._local, 'seq', 0)
+        # 解码和拷贝期间持有帧的引用，缓冲池中的图像不会被回收
+        frame = self._mailbox.wait_for_new_frame(after_seq, timeout, retain=True)
+        if frame is None:
+            return None
+        self._local.seq = frame.seq
+        try:
+            return frame.decode(profile)
+        finally:
+            frame.release()
 
-        while not self._image.size:
-            time.sleep(1)
-        return self._image
+    def borrow_picture(self, profile='full', timeout=None):
+        """借用一张新图片，不拷贝图像数据。借用的图像只能读取，用完后要归还：
+            with camera.borrow_picture() as pic:
+                ai.get_rect(pic)
+
+        Parameters
+        -----------
+        * profile: str
+            - 解码配置，见take_picture
+        * timeout: float
+            - 最长等待时间(秒)，None表示一直等待
+
+        Returns
+        -------
+        * FrameLoan or None
+            - 借用的帧，image为图像，release()归还；超时或帧源结束时返回None
+        """
+        after_seq = getattr(self._local, 'seq', 0)
+        frame = self._mailbox.wait_for_new_frame(after_seq, timeout, retain=True)
+        if frame is None:
+            return None
+        self._local.seq = frame.seq
+        return FrameLoan(frame, profile, readonly=True)
+
+    def pool_stats(self):
+        """解码缓冲池的统计数据，没有使用缓冲池时返回None
+        """
+        pool = self._mailbox.pool
+        return pool.stats() if pool is not None else None
 
     @staticmethod
     def save_picture(mat, path):
@@ -190,6 +1036,31 @@ class Camera(HttpMixin):
         image = camera.take_picture()
         camera.save_picture(image, './phone.jpg')  # 保存到当前目录下test.jpg文件
 
+    @staticmethod
+    def demo_record(ip, path='./record.tlr', seconds=60):
+        """录制小车摄像头视频到文件
+        """
+        camera = Camera()
+        camera.connect_server(ip)
+        camera.start_recording(path)
+        camera.start_receive()
+        time.sleep(seconds)
+        print('recorded frames:', camera.stop_recording())
+
+    @staticmethod
+    def demo_play_offline(path=None):
+        """不连接小车，回放录像文件(.tlr)或保存的MJPEG文件；没有指定文件时播放程序生成的测试图像
+        """
+        camera = Camera()
+        if path and path.endswith('.tlr'):
+            camera.open_source(RecordingSource(path, loop=True))
+        elif path:
+            camera.open_source(MjpegFileSource(path, loop=True))
+        else:
+            camera.open_source(SyntheticSource())
+        camera.start_receive()
+        camera.play()
+
 
 def main(ip):
     demo_index = int(input("请选择演示demo(0:显示摄像头视频，1：显示并保存一张图到本地):"))
@@ -0,0 +1,160 @@
+"""
+    摄像机录像文件。把视频流中的jpeg数据原样追加到一个文件中，不解码也不重新编码，
+    文件末尾保存每一帧的位置和时间索引。读取时使用内存映射(mmap)，可以直接访问任意一帧，
+    取出的jpeg数据是文件内存的切片，不需要拷贝。
+    文件格式(小端):
+        文件头:  b'TLREC001'
+        每一帧:  长度(uint32) 保留(uint32) 时间(float64) jpeg数据
+        索引:    每一帧 数据位置(uint64) 长度(uint32) 保留(uint32) 时间(float64)
+        文件尾:  索引位置(uint64) 帧数(uint64) b'TLRIDX01'
+    程序异常退出没有写入索引时，读取时会根据每一帧前面的长度重新建立索引。
+"""
+
+import mmap
+import struct
+import threading
+import numpy as np
+
+
+__authors__ = 'xiao long & xu lao shi'
+__version__ = 'version 0.02'
+__license__ = 'Copyright...'
+
+
+FILE_MAGIC = b'TLREC001'
+INDEX_MAGIC = b'TLRIDX01'
+RECORD_HEADER = struct.Struct('<IId')  # 长度 保留 时间
+FOOTER = struct.Struct('<QQ8s')  # 索引位置 帧数 标志
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('length', '<u4'), ('reserved', '<u4'), ('timestamp', '<f8')])
+
+
+class FrameRecorder:
+    """录像文件写入
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        -----------
+        * path: str
+            - 录像文件路径，已存在的文件会被覆盖
+        """
+        self.path = path
+        self._file = open(path, 'wb')
+        self._file.write(FILE_MAGIC)
+        self._position = len(FILE_MAGIC)
+        self._index = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._index)
+
+    def write(self, jpeg, timestamp):
+        """追加一帧jpeg数据
+
+        Parameters
+        -----------
+        * jpeg: bytes
+            - jpeg数据，原样保存
+        * timestamp: float
+            - 接收时间
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            length = len(jpeg)
+            self._file.write(RECORD_HEADER.pack(length, 0, timestamp))
+            self._file.write(jpeg)
+            offset = self._position + RECORD_HEADER.size
+            self._index.append((offset, length, 0, timestamp))
+            self._position = offset + length
+
+    def close(self):
+        """写入索引并关闭文件
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            index = np.array(self._index, dtype=INDEX_DTYPE)
+            self._file.write(index.tobytes())
+            self._file.write(FOOTER.pack(self._position, len(index), INDEX_MAGIC))
+            self._file.close()
+            self._file = None
+
+
+class FrameRecording:
+    """录像文件读取，通过内存映射随机访问任意一帧
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        -----------
+        * path: str
+            - 录像文件路径
+        """
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+        if bytes(self._view[:len(FILE_MAGIC)]) != FILE_MAGIC:
+            self.close()
+            raise ValueError('not a camera recording: {}'.format(path))
+        self.index = self._read_index()
+
+    def _read_index(self):
+        """读取文件末尾的索引，没有索引时逐帧扫描重建
+        """
+        size = len(self._mmap)
+        if size >= len(FILE_MAGIC) + FOOTER.size:
+            offset, count, magic = FOOTER.unpack_from(self._mmap, size - FOOTER.size)
+            if magic == INDEX_MAGIC and offset + count * INDEX_DTYPE.itemsize == size - FOOTER.size:
+                # 索引很小，拷贝出来，调用者拿着timestamps时文件也能关闭
+                return np.frombuffer(self._mmap, INDEX_DTYPE, count, offset).copy()
+        entries = []
+        position = len(FILE_MAGIC)
+        while position + RECORD_HEADER.size <= size:
+            length, _, timestamp = RECORD_HEADER.unpack_from(self._mmap, position)
+            offset = position + RECORD_HEADER.size
+            if offset + length > size:
+                break  # 最后一帧没有写完整
+            entries.append((offset, length, 0, timestamp))
+            position = offset + length
+        return np.array(entries, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        """第i帧的jpeg数据，返回文件内存的切片(memoryview)，不拷贝
+        """
+        entry = self.index[i]
+        offset = int(entry['offset'])
+        return self._view[offset:offset + int(entry['length'])]
+
+    @property
+    def timestamps(self):
+        """每一帧的接收时间(numpy array)
+        """
+        return self.index['timestamp']
+
+    def find(self, timestamp):
+        """查找时间不晚于timestamp的最后一帧
+
+        Return
+        -----------
+        * int:
+            - 帧序号，timestamp早于第一帧时返回0
+        """
+        return max(int(np.searchsorted(self.timestamps, timestamp, side='right')) - 1, 0)
+
+    def close(self):
+        """关闭文件，之前取出的切片要先释放
+        """
+        if self._mmap is None:
+            return
+        self.index = None
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
+        self._mmap = None
@@ -0,0 +1,380 @@
+"""
+    本机视频流中继。树莓派的CPU和Wi-Fi有限，每个连接mjpg-streamer的客户端进程（显示、检测、录像）
+    都会增加小车的编码和发送负担。MjpegRelay只和小车保持一个连接，然后在本机转发：
+    * http multipart视频流，格式和mjpg-streamer一样，Camera.connect_server('127.0.0.1', 8090)即可连接
+    * 共享内存环形缓冲区，同一台电脑上的进程用SharedMemorySource读取，不经过网络
+    提示：共享内存需要python3.8以上
+"""
+
+import http.server
+import socketserver
+import struct
+import threading
+import time
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # python3.8以下没有shared_memory
+    shared_memory = None
+
+try:
+    from .thinkland_rpi_camera_source import FrameSource, MjpegHttpSource
+except ImportError:
+    from thinkland_rpi_camera_source import FrameSource, MjpegHttpSource
+
+
+__authors__ = 'xiao long & xu lao shi'
+__version__ = 'version 0.02'
+__license__ = 'Copyright...'
+
+
+BOUNDARY = b'boundarydonotcross'
+RING_MAGIC = b'TLRING01'
+RING_HEADER = struct.Struct('<8sIIQ')  # 标志 槽数 每槽字节数 最新帧序号
+SLOT_HEADER = struct.Struct('<QIId')  # 帧序号 长度 保留 时间
+SLOT_TRAILER = struct.Struct('<Q')  # 写完后再写一次帧序号，读者据此判断数据是否完整
+_CREATED = set()  # 本进程创建的共享内存名字
+
+
+class SharedFrameRing:
+    """共享内存中的环形帧缓冲区，一个写者，多个读者
+    每个槽写入前后各写一次帧序号(seqlock)，读者拷贝数据后检查两个序号一致，写者不需要等待读者
+    """
+
+    def __init__(self, name, slots=8, slot_size=512 * 1024, create=False):
+        """
+        Parameters
+        -----------
+        * name: str
+            - 共享内存名字
+        * slots: int
+            - 槽数，create为True时有效
+        * slot_size: int
+            - 每个槽能保存的最大jpeg字节数，create为True时有效
+        * create: bool
+            - True创建(写者)，False连接已有的共享内存(读者)
+        """
+        if shared_memory is None:
+            raise RuntimeError('shared memory ring needs python3.8 or later')
+        self.name = name
+        if create:
+            size = RING_HEADER.size + slots * (SLOT_HEADER.size + slot_size + SLOT_TRAILER.size)
+            try:
+                self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+            except FileExistsError:  # 上一次没有正常退出，留下了同名的共享内存
+                old = shared_memory.SharedMemory(name)
+                old.close()
+                old.unlink()
+                self._shm = shared_memory.SharedMemory(name, create=True, size=size)
+            RING_HEADER.pack_into(self._shm.buf, 0, RING_MAGIC, slots, slot_size, 0)
+            _CREATED.add(name)
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+            if name not in _CREATED:
+                _untrack(self._shm)
+            magic, slots, slot_size, _ = RING_HEADER.unpack_from(self._shm.buf, 0)
+            if magic != RING_MAGIC:
+                self._shm.close()
+                raise ValueError('not a frame ring: {}'.format(name))
+        self.create = create
+        self.slots = slots
+        self.slot_size = slot_size
+        self._stride = SLOT_HEADER.size + slot_size + SLOT_TRAILER.size
+        self._seq = 0
+        self.oversized = 0  # 超过slot_size没有写入的帧数
+
+    def _slot_offset(self, seq):
+        return RING_HEADER.size + ((seq - 1) % self.slots) * self._stride
+
+    def write(self, jpeg, timestamp):
+        """写入一帧（只能由创建者调用）
+        """
+        length = len(jpeg)
+        if length > self.slot_size:
+            self.oversized += 1
+            return
+        self._seq += 1
+        buf = self._shm.buf
+        offset = self._slot_offset(self._seq)
+        SLOT_TRAILER.pack_into(buf, offset + SLOT_HEADER.size + self.slot_size, 0)
+        SLOT_HEADER.pack_into(buf, offset, self._seq, length, 0, timestamp)
+        data = offset + SLOT_HEADER.size
+        buf[data:data + length] = jpeg
+        SLOT_TRAILER.pack_into(buf, offset + SLOT_HEADER.size + self.slot_size, self._seq)
+        struct.pack_into('<Q', buf, RING_HEADER.size - 8, self._seq)
+
+    def latest_seq(self):
+        """最新一帧的序号
+        """
+        return struct.unpack_from('<Q', self._shm.buf, RING_HEADER.size - 8)[0]
+
+    def read(self, seq):
+        """读取序号为seq的帧
+
+        Return
+        -----------
+        * tuple or None:
+            - (jpeg数据, 时间)，该帧已经被覆盖或正在写入时返回None
+        """
+        buf = self._shm.buf
+        offset = self._slot_offset(seq)
+        slot_seq, length, _, timestamp = SLOT_HEADER.unpack_from(buf, offset)
+        if slot_seq != seq or length > self.slot_size:
+            return None
+        data = offset + SLOT_HEADER.size
+        jpeg = bytes(buf[data:data + length])
+        if SLOT_TRAILER.unpack_from(buf, data + self.slot_size)[0] != seq:
+            return None
+        if SLOT_HEADER.unpack_from(buf, offset)[0] != seq:
+            return None
+        return jpeg, timestamp
+
+    def close(self):
+        """关闭，创建者同时删除共享内存
+        """
+        if self._shm is None:
+            return
+        self._shm.close()
+        if self.create:
+            self._shm.unlink()
+            _CREATED.discard(self.name)
+        self._shm = None
+
+
+def _untrack(shm):
+    """连接已有共享内存的进程退出时，resource_tracker会误删共享内存，取消跟踪
+    """
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    except Exception:
+        pass
+
+
+class SharedMemorySource(FrameSource):
+    """从本机MjpegRelay的共享内存读取视频帧，Camera.open_source(SharedMemorySource())即可使用
+    """
+
+    def __init__(self, name='thinkland_camera', poll_interval=0.002, timeout=5.0):
+        """
+        Parameters
+        -----------
+        * name: str
+            - 共享内存名字，和MjpegRelay一致
+        * poll_interval: float
+            - 没有新帧时的查询间隔(秒)
+        * timeout: float
+            - 超过timeout秒没有新帧认为中继已经停止，None表示一直等待
+        """
+        super().__init__()
+        self.name = name
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.ring = None
+        self.skipped = 0  # 来不及读取被覆盖的帧数
+
+    def open(self):
+        self.ring = SharedFrameRing(self.name)
+
+    def frames(self):
+        seq = self.ring.latest_seq()
+        last_time = time.time()
+        while True:
+            latest = self.ring.latest_seq()
+            if latest <= seq:
+                if self.timeout is not None and time.time() - last_time > self.timeout:
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            if latest - seq > 1:
+                self.skipped += latest - seq - 1
+            seq = latest
+            result = self.ring.read(seq)
+            if result is None:
+                self.skipped += 1
+                continue
+            last_time = time.time()
+            self._pace()
+            yield result[0]
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+
+
+class MjpegRelay:
+    """视频流中继，只连接一次小车，在本机通过http和共享内存转发
+    """
+
+    def __init__(self, ip, port=8080, listen_host='127.0.0.1', listen_port=8090,
+                 shm_name='thinkland_camera', shm_slots=8, shm_slot_size=512 * 1024):
+        """
+        Parameters
+        -----------
+        * ip: str
+            - 树莓派的IP
+        * port: int
+            - mjpg-streamer端口
+        * listen_host: str
+            - 本机http服务地址，'0.0.0.0'可以让局域网的其他电脑连接
+        * listen_port: int
+            - 本机http服务端口，None表示不提供http服务
+        * shm_name: str
+            - 共享内存名字，None表示不使用共享内存
+        * shm_slots: int
+            - 共享内存的槽数
+        * shm_slot_size: int
+            - 每个槽的最大字节数
+        """
+        self.source = MjpegHttpSource(ip, port)
+        self.listen = (listen_host, listen_port)
+        self.shm_name = shm_name
+        self.shm_slots = shm_slots
+        self.shm_slot_size = shm_slot_size
+        self.ring = None
+        self.server = None
+        self._cond = threading.Condition()
+        self._jpeg = None
+        self._timestamp = 0.0
+        self._seq = 0
+        self._running = False
+        self._thread = None
+        self.clients = 0  # 当前http客户端个数，和sent一样在_cond中修改
+        self.sent = 0  # http发送的帧数
+
+    def start(self):
+        """连接小车，开始转发
+        """
+        self.source.open()
+        if self.shm_name:
+            self.ring = SharedFrameRing(self.shm_name, self.shm_slots, self.shm_slot_size, create=True)
+        if self.listen[1]:
+            self.server = _RelayServer(self.listen, _make_handler(self))
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            print('relay: http://{}:{}/?action=streamer'.format(*self.listen))
+        self._running = True
+        self._thread = threading.Thread(target=self._receive, daemon=True)
+        self._thread.start()
+
+    def _receive(self):
+        for jpeg in self.source.frames():
+            timestamp = time.time()
+            with self._cond:
+                # 在锁中检查是否已停止，stop关闭共享内存之后不会再写入
+                if not self._running:
+                    break
+                if self.ring is not None:
+                    self.ring.write(jpeg, timestamp)
+                self._seq += 1
+                self._jpeg = jpeg
+                self._timestamp = timestamp
+                self._cond.notify_all()
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def wait_for_new_frame(self, after_seq, timeout=None):
+        """等待新帧
+
+        Return
+        -----------
+        * tuple or None:
+            - (帧序号, jpeg数据, 时间)，超时或中继停止时返回None
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after_seq or not self._running, timeout)
+            if self._seq <= after_seq:
+                return None
+            return self._seq, self._jpeg, self._timestamp
+
+    def stop(self):
+        """停止转发
+        """
+        with self._cond:
+            self._running = False
+            ring, self.ring = self.ring, None
+            self._cond.notify_all()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.source.close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if ring is not None:
+            ring.close()
+
+    def stats(self):
+        """
+        Return
+        -----------
+        * dict:
+            - upstream: 上游视频流的统计(帧数、fps、MB/s等)
+            - clients: 当前http客户端个数
+            - sent: http发送的帧数
+        """
+        with self._cond:
+            clients, sent = self.clients, self.sent
+        return {'upstream': self.source.stats(), 'clients': clients, 'sent': sent}
+
+
+class _RelayServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def _make_handler(relay):
+    """生成http请求处理类，任何路径都返回multipart视频流
+    """
+
+    class RelayHandler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('Content-Type', 'multipart/x-mixed-replace;boundary=' + BOUNDARY.decode())
+            self.end_headers()
+            with relay._cond:
+                relay.clients += 1
+            seq = 0
+            try:
+                while True:
+                    frame = relay.wait_for_new_frame(seq, timeout=5.0)
+                    if frame is None:
+                        if not relay._running:
+                            break
+                        continue
+                    seq, jpeg, timestamp = frame
+                    self.wfile.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n'
+                                     b'Content-Length: %d\r\nX-Timestamp: %.6f\r\n\r\n' % (len(jpeg), timestamp))
+                    self.wfile.write(jpeg)
+                    self.wfile.write(b'\r\n')
+                    with relay._cond:
+                        relay.sent += 1
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                with relay._cond:
+                    relay.clients -= 1
+
+        def log_message(self, format, *args):
+            pass
+
+    return RelayHandler
+
+
+def main():
+    ip = input("请输入树莓的IP:")
+    relay = MjpegRelay(ip)
+    relay.start()
+    print("本机连接方式: Camera.connect_server('127.0.0.1', 8090) 或 Camera.open_source(SharedMemorySource())")
+    try:
+        while True:
+            time.sleep(5)
+            print(relay.stats())
+    except KeyboardInterrupt:
+        relay.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+    摄像机帧源。Camera通过帧源获取图像，可以是小车上的mjpg-streamer视频流，
+    也可以是录制的视频文件、本机的摄像头或者程序生成的测试图像。
+    这样没有小车时也可以在电脑上离线测试检测和巡线的效果，并且可以比实时更快地回放。
+    帧源产生的数据有两种：jpeg数据(bytes)，由Camera按需解码；已经解码的图像(numpy array)。
+"""
+
+import time
+import urllib
+import urllib.request
+import cv2
+import numpy as np
+
+try:
+    from .thinkland_rpi_mjpeg import MjpegSplitter
+    from .thinkland_rpi_camera_record import FrameRecording
+except ImportError:
+    from thinkland_rpi_mjpeg import MjpegSplitter
+    from thinkland_rpi_camera_record import FrameRecording
+
+
+__authors__ = 'xiao long & xu lao shi'
+__version__ = 'version 0.02'
+__license__ = 'Copyright...'
+
+
+class FrameSource:
+    """帧源基类
+    子类实现open和frames，frames依次产生jpeg数据(bytes)或图像(numpy array)
+    """
+
+    def __init__(self, fps=None):
+        """
+        Parameters
+        -----------
+        * fps: float
+            - 回放帧率，None表示不限速，尽可能快地产生数据
+        """
+        self.fps = fps
+        self.frames_total = 0
+        self._start_time = None
+        self._next_time = None
+
+    def open(self):
+        """打开帧源
+        """
+        pass
+
+    def frames(self):
+        """依次产生每一帧的数据
+
+        Return
+        -----------
+        * generator:
+            - jpeg数据(bytes)或图像(numpy array)
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """关闭帧源
+        """
+        pass
+
+    def _pace(self):
+        """按fps控制产生数据的速度
+        """
+        now = time.time()
+        if self._start_time is None:
+            self._start_time = self._next_time = now
+        self.frames_total += 1
+        if not self.fps:
+            return
+        if self._next_time > now:
+            time.sleep(self._next_time - now)
+        self._next_time = max(self._next_time, now - 1.0) + 1.0 / self.fps
+
+    def stats(self):
+        """帧源的统计数据
+
+        Return
+        -----------
+        * dict:
+            - frames: 产生的帧数
+            - fps: 平均每秒帧数
+        """
+        if self._start_time is None:
+            return {'frames': 0, 'fps': 0.0}
+        elapsed = max(time.time() - self._start_time, 1e-6)
+        return {'frames': self.frames_total, 'fps': self.frames_total / elapsed}
+
+
+class MjpegHttpSource(FrameSource):
+    """小车上mjpg-streamer的http视频流
+    """
+
+    def __init__(self, ip, port=8080):
+        super().__init__()
+        self.url = 'http://{}:{}/?action=streamer'.format(ip, port)
+        self.stream = None
+        self.splitter = MjpegSplitter()
+
+    def open(self):
+        print("streamer_url", self.url)
+        self.stream = urllib.request.urlopen(self.url)
+
+    def frames(self):
+        for jpg in self.splitter.frames(self.stream):
+            self._pace()
+            yield jpg
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.close()
+
+    def stats(self):
+        return self.splitter.stats()
+
+
+class MjpegFileSource(FrameSource):
+    """回放保存下来的MJPEG数据文件（例如用curl保存的视频流，或多个jpeg直接拼接的文件）
+    """
+
+    def __init__(self, path, fps=30, loop=False):
+        """
+        Parameters
+        -----------
+        * path: str
+            - 文件路径
+        * fps: float
+            - 回放帧率，None表示以最快速度回放
+        * loop: bool
+            - 播放完后是否从头循环
+        """
+        super().__init__(fps)
+        self.path = path
+        self.loop = loop
+        self.splitter = MjpegSplitter()
+
+    def frames(self):
+        while True:
+            with open(self.path, 'rb') as f:
+                for jpg in self.splitter.frames(f):
+                    self._pace()
+                    yield jpg
+            if not self.loop:
+                return
+            self.splitter.reset()
+
+
+class RecordingSource(FrameSource):
+    """回放Camera.start_recording录制的文件，按录制时的时间间隔回放，或者以最快速度回放
+    """
+
+    def __init__(self, path, speed=1.0, loop=False, start=0, stop=None):
+        """
+        Parameters
+        -----------
+        * path: str
+            - 录像文件路径
+        * speed: float
+            - 回放速度倍数，1.0为录制时的原速，None表示以最快速度回放
+        * loop: bool
+            - 播放完后是否从头循环
+        * start: int
+            - 开始的帧序号
+        * stop: int
+            - 结束的帧序号(不包含)，None表示到最后一帧
+        """
+        super().__init__()
+        self.path = path
+        self.speed = speed
+        self.loop = loop
+        self.start = start
+        self.stop = stop
+        self.recording = None
+
+    def open(self):
+        self.recording = FrameRecording(self.path)
+
+    def frames(self):
+        recording = self.recording
+        stop = len(recording) if self.stop is None else min(self.stop, len(recording))
+        timestamps = recording.timestamps
+        while True:
+            begin = None
+            for i in range(self.start, stop):
+                if self.speed:
+                    now = time.time()
+                    if begin is None:
+                        begin = now - (timestamps[i] - timestamps[self.start]) / self.speed
+                    delay = begin + (timestamps[i] - timestamps[self.start]) / self.speed - now
+                    if delay > 0:
+                        time.sleep(delay)
+                self._pace()
+                # 帧会在Camera中保存一段时间，拷贝出来，回放结束后才能关闭文件
+                yield bytes(recording[i])
+            if not self.loop:
+                return
+
+    def close(self):
+        if self.recording is not None:
+            self.recording.close()
+
+
+class DeviceSource(FrameSource):
+    """通过cv2.VideoCapture读取本机摄像头或视频文件(mp4、avi等)
+    """
+
+    def __init__(self, device=0, width=None, height=None, fps=None, loop=False):
+        """
+        Parameters
+        -----------
+        * device: int or str
+            - 摄像头编号或视频文件路径
+        * width: int
+            - 图像宽度，None表示使用默认值
+        * height: int
+            - 图像高度，None表示使用默认值
+        * fps: float
+            - 视频文件的回放帧率，None表示以最快速度回放；摄像头由设备本身控制速度
+        * loop: bool
+            - 视频文件播放完后是否从头循环
+        """
+        super().__init__(fps)
+        self.device = device
+        self.width = width
+        self.height = height
+        self.loop = loop
+        self.capture = None
+
+    def open(self):
+        self.capture = cv2.VideoCapture(self.device)
+        if not self.capture.isOpened():
+            raise IOError('can not open video device: {}'.format(self.device))
+        if self.width:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        if self.height:
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+
+    def frames(self):
+        while True:
+            ok, image = self.capture.read()
+            if not ok:
+                if self.loop and isinstance(self.device, str):
+                    self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                return
+            self._pace()
+            yield image
+
+    def close(self):
+        if self.capture is not None:
+            self.capture.release()
+
+
+class SyntheticSource(FrameSource):
+    """生成测试图像：在灰色背景上移动的彩色方块，方便没有小车时测试整个流程
+    """
+
+    def __init__(self, width=640, height=480, fps=30, count=None, encode=True, quality=80):
+        """
+        Parameters
+        -----------
+        * width: int
+            - 图像宽度
+        * height: int
+            - 图像高度
+        * fps: float
+            - 帧率，None表示以最快速度产生
+        * count: int
+            - 产生的帧数，None表示无限
+        * encode: bool
+            - 为True时编码为jpeg，和小车视频流的数据一样；否则直接产生图像
+        * quality: int
+            - jpeg质量
+        """
+        super().__init__(fps)
+        self.width = width
+        self.height = height
+        self.count = count
+        self.encode = encode
+        self.quality = quality
+
+    def render(self, index):
+        """生成第index帧图像
+        """
+        image = np.full((self.height, self.width, 3), 96, np.uint8)
+        size = min(self.width, self.height) // 6
+        x = int((self.width - size) * (0.5 + 0.5 * np.sin(index / 30.0)))
+        y = int((self.height - size) * (0.5 + 0.5 * np.cos(index / 45.0)))
+        cv2.rectangle(image, (x, y), (x + size, y + size), (0, 0, 255), -1)
+        cv2.putText(image, str(index), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        return image
+
+    def frames(self):
+        index = 0
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        while self.count is None or index < self.count:
+            image = self.render(index)
+            index += 1
+            self._pace()
+            if self.encode:
+                yield cv2.imencode('.jpg', image, params)[1].tobytes()
+            else:
+                yield image
@@ -0,0 +1,245 @@
+"""
+    MJPEG流分帧模块。mjpg-streamer通过http multipart方式推送jpeg图片，
+    每一帧的格式大致为:
+        --boundarydonotcross
+        Content-Type: image/jpeg
+        Content-Length: 23456
+        X-Timestamp: 1551931520.743
+
+        <jpeg数据 FF D8 ... FF D9>
+    MjpegSplitter使用一块预先分配、可重复利用的bytearray作为接收缓冲区，
+    每次用readinto读取大块数据，只扫描新到达的字节，有Content-Length时直接按长度取帧
+    (长度处不是EOI时改为查找EOI)，并且对缓冲区大小设置上限，坏帧不会导致内存无限增长。
+"""
+
+import time
+
+
+__authors__ = 'xiao long & xu lao shi'
+__version__ = 'version 0.02'
+__license__ = 'Copyright...'
+
+
+SOI = b'\xff\xd8'  # jpeg起始标志
+EOI = b'\xff\xd9'  # jpeg结束标志
+
+
+class MjpegSplitter:
+    """MJPEG流分帧器
+    """
+
+    def __init__(self, chunk_size=64 * 1024, max_buffer=4 * 1024 * 1024, report_interval=0):
+        """
+        Parameters
+        -----------
+        * chunk_size: int
+            - 每次readinto读取的最大字节数
+        * max_buffer: int
+            - 缓冲区上限（字节），超过后丢弃缓冲数据重新同步
+        * report_interval: float
+            - 大于0时，每隔report_interval秒打印一次吞吐量
+        """
+        assert max_buffer >= 2 * chunk_size
+        self.chunk_size = chunk_size
+        self.max_buffer = max_buffer
+        self.report_interval = report_interval
+        self._buffer = bytearray(max_buffer)
+        self._view = memoryview(self._buffer)
+        self.reset()
+
+        self.frames_total = 0  # 成功分出的帧数
+        self.bytes_total = 0  # 读取的字节数
+        self.overflows = 0  # 缓冲区溢出次数
+        self.dropped_bytes = 0  # 溢出时丢弃的字节数
+        self.bad_lengths = 0  # 和数据不符的Content-Length个数
+        self._start_time = None
+        self._report_time = None
+        self._report_frames = 0
+        self._report_bytes = 0
+
+    def reset(self):
+        """清空缓冲区和解析状态
+        """
+        self._start = 0  # 未处理数据起点
+        self._end = 0  # 未处理数据终点
+        self._scan = 0  # 下一次搜索的位置，保证只扫描新数据
+        self._soi = -1  # 当前帧起点，-1表示还没找到
+        self._length = -1  # 当前帧Content-Length，-1表示未知
+
+    def _compact(self):
+        """把未处理数据移动到缓冲区开头，保证尾部有chunk_size的空间
+        """
+        size = self._end - self._start
+        if size >= self.max_buffer - self.chunk_size:
+            # 缓冲区已满却仍未凑成一帧，说明数据损坏，丢弃后重新同步
+            self.overflows += 1
+            self.dropped_bytes += size
+            self.reset()
+            return
+        if self._start:
+            offset = self._start
+            self._buffer[0:size] = self._view[offset:self._end]
+            self._start = 0
+            self._end = size
+            self._scan -= offset
+            if self._soi >= 0:
+                self._soi -= offset
+
+    def _read(self, stream):
+        """从流中读取一块数据到缓冲区尾部
+
+        Return
+        -----------
+        * int:
+            - 读取到的字节数，0表示流已结束
+        """
+        if self._end + self.chunk_size > self.max_buffer:
+            self._compact()
+        target = self._view[self._end:self._end + self.chunk_size]
+        # readinto1只做一次底层读取，有多少数据返回多少，不会为了填满chunk_size而等待
+        readinto = getattr(stream, 'readinto1', None) or getattr(stream, 'readinto', None)
+        if readinto is not None:
+            n = readinto(target)
+        else:
+            data = stream.read(self.chunk_size)
+            n = len(data)
+            target[:n] = data
+        if not n:
+            return 0
+        self._end += n
+        self.bytes_total += n
+        return n
+
+    def _parse_length(self, header_end):
+        """在帧头（上一帧结束到SOI之间）中查找Content-Length
+        """
+        header = bytes(self._view[self._start:header_end]).lower()
+        pos = header.rfind(b'content-length:')
+        if pos == -1:
+            return -1
+        line_end = header.find(b'\r\n', pos)
+        try:
+            return int(header[pos + 15:line_end if line_end != -1 else None])
+        except ValueError:
+            return -1
+
+    def _next_frame(self):
+        """尝试从缓冲区中切出一帧
+
+        Return
+        -----------
+        * bytes or None:
+            - jpeg数据，数据不足一帧时返回None
+        """
+        buffer = self._buffer
+        if self._soi < 0:
+            soi = buffer.find(SOI, self._scan, self._end)
+            if soi == -1:
+                # 保留最后一个字节，防止标志被拆在两次读取之间
+                self._scan = max(self._start, self._end - 1)
+                return None
+            self._soi = soi
+            self._length = self._parse_length(soi)
+            if self._length > self.max_buffer - self.chunk_size:
+                self._length = -1
+            self._scan = soi + 2
+
+        if self._length > 0:
+            frame_end = self._soi + self._length
+            if frame_end > self._end:
+                return None
+            if not self._valid_end(frame_end):
+                # Content-Length和数据不符，改为从SOI之后查找EOI
+                self.bad_lengths += 1
+                self._length = -1
+        if self._length <= 0:
+            eoi = buffer.find(EOI, self._scan, self._end)
+            if eoi == -1:
+                self._scan = max(self._soi + 2, self._end - 1)
+                return None
+            frame_end = eoi + 2
+
+        jpg = bytes(self._view[self._soi:frame_end])
+        self._start = frame_end
+        self._scan = frame_end
+        self._soi = -1
+        self._length = -1
+        if self._start == self._end:
+            self._start = self._end = self._scan = 0
+        self.frames_total += 1
+        return jpg
+
+    def _valid_end(self, frame_end):
+        """按Content-Length切出的帧必须以EOI结尾，后面(已经收到时)紧跟换行或下一个boundary
+        """
+        if self._view[frame_end - 2:frame_end] != EOI:
+            return False
+        return frame_end == self._end or self._buffer[frame_end] in b'\r\n-'
+
+    def frames(self, stream):
+        """从流中不断切出jpeg帧
+
+        Parameters
+        -----------
+        * stream: file-like
+            - 支持readinto或read的流，例如urlopen返回的对象
+
+        Return
+        -----------
+        * generator:
+            - 依次产生每一帧的jpeg数据(bytes)
+        """
+        if self._start_time is None:
+            self._start_time = self._report_time = time.time()
+        while True:
+            jpg = self._next_frame()
+            if jpg is not None:
+                self._report()
+                yield jpg
+                continue
+            if not self._read(stream):
+                if self._length > 0:
+                    # 流结束时仍不够Content-Length，长度是错的，最后再按EOI找一次
+                    self.bad_lengths += 1
+                    self._length = -1
+                    continue
+                return
+
+    def throughput(self):
+        """统计从开始接收到现在的平均吞吐量
+
+        Return
+        -----------
+        * float:
+            - 每秒帧数
+        * float:
+            - 每秒MB数
+        """
+        if self._start_time is None:
+            return 0.0, 0.0
+        elapsed = max(time.time() - self._start_time, 1e-6)
+        return self.frames_total / elapsed, self.bytes_total / elapsed / (1024 * 1024)
+
+    def stats(self):
+        """分帧器的统计数据
+        """
+        fps, mbps = self.throughput()
+        return {'frames': self.frames_total, 'bytes': self.bytes_total, 'fps': fps, 'mbps': mbps,
+                'overflows': self.overflows, 'dropped_bytes': self.dropped_bytes, 'bad_lengths': self.bad_lengths,
+                'buffered': self._end - self._start}
+
+    def _report(self):
+        """按report_interval打印最近一段时间的吞吐量
+        """
+        if self.report_interval <= 0:
+            return
+        now = time.time()
+        elapsed = now - self._report_time
+        if elapsed < self.report_interval:
+            return
+        fps = (self.frames_total - self._report_frames) / elapsed
+        mbps = (self.bytes_total - self._report_bytes) / elapsed / (1024 * 1024)
+        print('mjpeg: %.1f fps, %.2f MB/s, overflows %d' % (fps, mbps, self.overflows))
+        self._report_time = now
+        self._report_frames = self.frames_total
+        self._report_bytes = self.bytes_total
@@ -0,0 +1,189 @@
+"""
+    控制回路的延迟跟踪。每一帧在接收时记录时间(Frame.timestamp)，之后的解码、识别(Ai.find_object
+    或Algrithm.line)、决策、小车rpc调用都用同一个帧做标记，可以看到发出运动命令时图像已经过去了多久，
+    以及时间主要花在哪一步。
+    * 每一步的耗时和帧的“年龄”(开始这一步时距离接收过去的时间)统计p50/p95/p99
+    * 导出Chrome trace格式文件，用chrome://tracing或https://ui.perfetto.dev打开查看
+    用法:
+        tracer = LatencyTracer()
+        frame = camera.take_frame()
+        with tracer.span('decode', frame):
+            pic = frame.decode('gray')
+        with tracer.span('line', frame):
+            pt = algithm.line(pic)
+        with tracer.span('car', frame):
+            car.run_forward(speed, dis)
+        tracer.report()
+        tracer.export_chrome_trace('./trace.json')
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+import numpy as np
+
+
+__authors__ = 'xiao long & xu lao shi'
+__version__ = 'version 0.02'
+__license__ = 'Copyright...'
+
+
+class _Span:
+    """一个步骤的计时，用with语句使用
+    """
+
+    def __init__(self, tracer, stage, frame):
+        self.tracer = tracer
+        self.stage = stage
+        self.frame = frame
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.tracer.record(self.stage, self.start, time.time(), self.frame)
+
+
+class _NullSpan:
+    """关闭跟踪时使用，不做任何事
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+class LatencyTracer:
+    """按帧跟踪各个步骤的延迟
+    """
+
+    def __init__(self, enabled=True, window=2000, max_events=200000):
+        """
+        Parameters
+        -----------
+        * enabled: bool
+            - 为False时span不做任何事，可以一直保留在代码中
+        * window: int
+            - 每个步骤保留最近window次的数据用来计算百分位
+        * max_events: int
+            - 为Chrome trace保留的最多事件数
+        """
+        self.enabled = enabled
+        self.window = window
+        self._lock = threading.Lock()
+        self._durations = collections.OrderedDict()  # 步骤 -> 最近的耗时(秒)
+        self._ages = collections.OrderedDict()  # 步骤 -> 开始时帧的年龄(秒)
+        self._events = collections.deque(maxlen=max_events)
+        self._last_received = 0  # 最近记录过接收事件的帧序号
+        self._null = _NullSpan()
+
+    def span(self, stage, frame=None):
+        """记录一个步骤
+
+        Parameters
+        -----------
+        * stage: str
+            - 步骤名，例如'decode'、'detect'、'line'、'decision'、'car'
+        * frame: Frame
+            - 这一步处理的帧(Camera.take_frame的返回值)，用来计算帧的年龄
+
+        Return
+        -----------
+        * context manager:
+            - 用with语句包住这一步的代码
+        """
+        if not self.enabled:
+            return self._null
+        return _Span(self, stage, frame)
+
+    def record(self, stage, start, end, frame=None):
+        """直接记录一个步骤的开始和结束时间(time.time())
+        """
+        if not self.enabled:
+            return
+        seq = getattr(frame, 'seq', None)
+        received = getattr(frame, 'timestamp', None)
+        pid = os.getpid()
+        tid = threading.get_ident()
+        with self._lock:
+            durations = self._durations.get(stage)
+            if durations is None:
+                durations = self._durations[stage] = collections.deque(maxlen=self.window)
+                self._ages[stage] = collections.deque(maxlen=self.window)
+            durations.append(end - start)
+            if received is not None:
+                self._ages[stage].append(start - received)
+                if seq is not None and seq > self._last_received:
+                    self._last_received = seq
+                    self._events.append({'name': 'receive', 'ph': 'i', 's': 'g', 'ts': received * 1e6,
+                                         'pid': pid, 'tid': tid, 'args': {'seq': seq}})
+            args = {} if seq is None else {'seq': seq}
+            if received is not None:
+                args['age_ms'] = (start - received) * 1000
+            self._events.append({'name': stage, 'cat': 'control', 'ph': 'X', 'ts': start * 1e6,
+                                 'dur': (end - start) * 1e6, 'pid': pid, 'tid': tid, 'args': args})
+
+    def record_decode(self, frame, profile='full'):
+        """记录帧的解码步骤，解码由Frame.decode完成，可能发生在其他线程
+
+        Parameters
+        -----------
+        * frame: Frame or FrameLoan
+            - 已经解码的帧
+        * profile: str
+            - 解码配置
+        """
+        span = getattr(getattr(frame, 'frame', frame), 'decode_spans', {}).get(profile)
+        if span is not None:
+            self.record('decode', span[0], span[1], frame)
+
+    def percentiles(self):
+        """各个步骤的延迟百分位(毫秒)
+
+        Return
+        -----------
+        * dict:
+            - 步骤名 -> {'count', 'p50', 'p95', 'p99', 'age_p50', 'age_p95', 'age_p99'}
+              p为这一步的耗时，age为开始这一步时帧已经过去的时间
+        """
+        result = collections.OrderedDict()
+        with self._lock:
+            items = [(stage, list(self._durations[stage]), list(self._ages[stage])) for stage in self._durations]
+        for stage, durations, ages in items:
+            stats = {'count': len(durations)}
+            p = np.percentile(np.array(durations) * 1000, [50, 95, 99])
+            stats.update(p50=p[0], p95=p[1], p99=p[2])
+            if ages:
+                p = np.percentile(np.array(ages) * 1000, [50, 95, 99])
+                stats.update(age_p50=p[0], age_p95=p[1], age_p99=p[2])
+            result[stage] = stats
+        return result
+
+    def report(self):
+        """打印各个步骤的延迟(毫秒)
+        """
+        print('%-12s %7s %8s %8s %8s %9s %9s %9s' % ('stage', 'count', 'p50', 'p95', 'p99',
+                                                    'age_p50', 'age_p95', 'age_p99'))
+        for stage, stats in self.percentiles().items():
+            print('%-12s %7d %8.1f %8.1f %8.1f %9.1f %9.1f %9.1f' % (
+                stage, stats['count'], stats['p50'], stats['p95'], stats['p99'],
+                stats.get('age_p50', 0.0), stats.get('age_p95', 0.0), stats.get('age_p99', 0.0)))
+
+    def export_chrome_trace(self, path):
+        """导出Chrome trace格式的文件
+
+        Parameters
+        -----------
+        * path: str
+            - 文件路径，例如'./trace.json'
+        """
+        with self._lock:
+            events = list(self._events)
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
@@ -5,13 +5,17 @@ print(type)
 if 'Mac' in type:
     from client.carLib.thinkland_rpi_camera_client import Camera
     from client.aiLib.thinkland_rpi_ai import Ai
+    from client.aiLib.thinkland_rpi_ai_multi import MultiAi
     from client.carLib.thinkland_rpi_car_client import Car
     from client.aiLib.thinkland_rpi_algorithm import Algrithm
+    from client.carLib.thinkland_rpi_trace import LatencyTracer
 else:
     from carLib.thinkland_rpi_camera_client import Camera
     from aiLib.thinkland_rpi_ai import Ai
+    from aiLib.thinkland_rpi_ai_multi import MultiAi
     from carLib.thinkland_rpi_car_client import Car
     from aiLib.thinkland_rpi_algorithm import Algrithm
+    from carLib.thinkland_rpi_trace import LatencyTracer
 
 import cv2
 from pynput import keyboard
@@ -45,7 +49,7 @@ def start_listenser_thread():
     threadId = threading.Thread(target= listenser)
     threadId.start()
 
-def demo_line_algrithm(ip,speed,dis):
+def demo_line_algrithm(ip,speed,dis,trace_path=None):
     """
     利用图像传统知识进行巡线,对图像进行二值化，选取组最大的轮廓的中心点。图像的长640，宽480。
      0  左转 250  直行 320  直行 380 右转  640
@@ -58,7 +62,11 @@ def demo_line_algrithm(ip,speed,dis):
         -小车运行速度
      * dis：float
         -运行的时间，控制距离
+     * trace_path:string
+        -不为None时跟踪每一帧从接收到发出运动命令的延迟，结束时打印并导出Chrome trace文件
     """
+    #延迟跟踪
+    tracer = LatencyTracer(enabled=trace_path is not None)
     #相机的初始化
     camera = Camera()
     camera.connect_server(ip)
@@ -71,20 +79,27 @@ def demo_line_algrithm(ip,speed,dis):
 
     global STOP_FLAGE
     while True:
-        pic = camera.take_picture()
-        pt = algithm.line(pic,60)
+        frame = camera.take_frame()
+        with tracer.span('decode', frame):
+            pic = frame.decode('gray')  # 巡线只需要灰度图
+        with tracer.span('line', frame):
+            pt = algithm.line(pic,60)
         # algithm.set_debug()
         x = pt[0]
         print('%d和320比较'%x)
-        if 250 < x < 380:
-            car.run_forward(speed, dis) #直行
-        elif x < 250:
-            print("spin left")
-            car.turn_left(speed * 0.6, dis) #左转
-        elif x > 380:
-            print("spin right")
-            car.turn_right(speed * 0.6, dis)#右转
+        with tracer.span('car', frame):
+            if 250 < x < 380:
+                car.run_forward(speed, dis) #直行
+            elif x < 250:
+                print("spin left")
+                car.turn_left(speed * 0.6, dis) #左转
+            elif x > 380:
+                print("spin right")
+                car.turn_right(speed * 0.6, dis)#右转
         if STOP_FLAGE:
+            if trace_path is not None:
+                tracer.report()
+                tracer.export_chrome_trace(trace_path)
             return
 
 ######################################################################################
@@ -140,6 +155,54 @@ def demo_line_ai(ip, speed, dis):
         if STOP_FLAGE:
             return
 
+def demo_line_ai_find_object(ip, speed, dis, object='cup'):
+    """
+    用训练的巡线模型巡线，同时用coco模型寻找物体，找到后停车。
+    两个模型由MultiAi管理，每一帧只缩放、归一化一次
+
+    Param
+    -----
+    *ip: string
+        -树莓的ip
+    *speed: int
+        -运行速度
+    *dis: int
+        -检测一次走的距离
+    *object: string
+        -要寻找的物体
+    """
+    #相机初始化
+    camera = Camera()
+    camera.connect_server(ip)
+    camera.start_receive()
+    #车初始化
+    car = Car(ip)
+    #coco模型和自己训练的巡线模型，需要aiLib/line/line.weights
+    multi = MultiAi()
+
+    global STOP_FLAGE
+    while not STOP_FLAGE:
+        loan = camera.borrow_picture()
+        with loan as pic:
+            results = multi.detect(pic, loan.seq)
+        if object in results['coco'].names:
+            print('find', object)
+            car.stop_all_wheels()
+            break
+
+        line = results['line'].best('line')
+        if line is None: #没有检测到线
+            continue
+        x = line['x'] + line['w'] / 2
+
+        if 250 < x < 380:
+            car.run_forward(speed, dis) #直行
+        elif x < 250:
+            car.turn_left(speed * 0.6, dis)#左转
+        elif x > 380:
+            car.turn_right(speed * 0.6, dis)#右转
+    multi.close()
+
 def main():
     """
     例子
@@ -5,15 +5,21 @@ print(type)
 if 'Mac' in type:
     from client.carLib.thinkland_rpi_camera_client import Camera
     from client.aiLib.thinkland_rpi_ai import  Ai
+    from client.aiLib.thinkland_rpi_ai_service import DetectionService
+    from client.aiLib.thinkland_rpi_ai_tracker import TrackingDetector
+    from client.aiLib.thinkland_rpi_ai_gate import ChangeGate
     from client.aiLib.thinkland_rpi_speaker import Speaker
 else:
     from carLib.thinkland_rpi_camera_client import Camera
     from aiLib.thinkland_rpi_ai import  Ai
+    from aiLib.thinkland_rpi_ai_service import DetectionService
+    from aiLib.thinkland_rpi_ai_tracker import TrackingDetector
+    from aiLib.thinkland_rpi_ai_gate import ChangeGate
     from aiLib.thinkland_rpi_speaker import Speaker
 
 import cv2
 
-def demo_ai_camera(ip):
+def demo_ai_camera(ip, budget=None):
     """
     智能相机的构建，实时识别相机中的物体
 
@@ -21,12 +27,15 @@ def demo_ai_camera(ip):
     ----
     *ip：string
         -树莓派的Ip
+    *budget：float
+        -每一帧识别的延迟预算(秒)，例如0.2，根据电脑的速度自动调整网络输入尺寸；None表示固定尺寸
     """
     camera = Camera()
     camera.connect_server(ip)
     camera.start_receive()
 
     ai = Ai()
+    ai.set_latency_budget(budget)
 
     while True:
         pic = camera.take_picture()
@@ -36,6 +45,70 @@ def demo_ai_camera(ip):
         if k == 27:  # wait for ESC key to exit
             cv2.destroyAllWindows()
             break
+    if ai.resolution is not None:
+        print(ai.resolution.stats())
+
+def demo_ai_camera_async(ip):
+    """
+    智能相机的构建，识别在后台线程中进行，视频按相机的帧率显示，
+    每一帧画上最近一次的识别结果
+
+    Parameter
+    ----
+    *ip：string
+        -树莓派的Ip
+    """
+    camera = Camera()
+    camera.connect_server(ip)
+    camera.start_receive()
+
+    service = DetectionService(Ai())
+
+    while True:
+        frame = camera.take_frame()
+        if frame is None:
+            break
+        service.submit(frame)  # 不等待识别结果
+        detections = service.latest()
+        pic = frame.image
+        if detections is not None:
+            pic = service.ai.annotate(pic, detections)
+        cv2.imshow("ai", pic)
+        k = cv2.waitKey(1)
+        if k == 27:  # wait for ESC key to exit
+            cv2.destroyAllWindows()
+            break
+    print(service.stats())
+    service.close()
+
+def demo_ai_camera_tracking(ip, interval=10):
+    """
+    智能相机的构建，每隔interval帧用Ai识别一次，中间的帧用光流跟踪识别到的物体
+
+    Parameter
+    ----
+    *ip：string
+        -树莓派的Ip
+    *interval：int
+        -最多每隔多少帧识别一次，跟踪不可靠时会提前识别
+    """
+    camera = Camera()
+    camera.connect_server(ip)
+    camera.start_receive()
+
+    ai = Ai()
+    tracker = TrackingDetector(ai, interval=interval)
+
+    while True:
+        pic = camera.take_picture()
+        detections = tracker.detect(pic)
+        pic = ai.annotate(pic, detections)
+        cv2.imshow("ai", pic)
+        k = cv2.waitKey(1)
+        if k == 27:  # wait for ESC key to exit
+            cv2.destroyAllWindows()
+            break
+    print(tracker.stats())
 
 def demo_ai_camera_speaker(ip):
     """
@@ -52,20 +125,24 @@ def demo_ai_camera_speaker(ip):
     camera.start_receive()
 
     ai = Ai()
+    gate = ChangeGate(ai)  # 画面没有变化时重用上一次的识别结果
     speaker = Speaker()
 
     interval = 20
     times    = 0
     while True:
         pic = camera.take_picture()
-        ret,names,box= ai.find_object(pic)
+        detections = gate.detect(pic)
+        names = detections.names
+        pic = ai.annotate(pic, detections)
 
-        cv2.imshow("ai", ret)
+        cv2.imshow("ai", pic)
         cv2.waitKey(1)
 
         times = times + 1
         if times > interval:
             times = 0
+            print(gate.stats())
             if len(names) > 0:
                 speaker.say('i find')
             for item in names:
@@ -5,14 +5,21 @@ if 'Mac' in type:
     from client.carLib.thinkland_rpi_camera_client import Camera
     from client.carLib.thinkland_rpi_car_client import Car
     from client.aiLib.thinkland_rpi_ai import Ai
+    from client.aiLib.thinkland_rpi_ai_tracker import TrackingDetector
+    from client.aiLib.thinkland_rpi_ai_overlay import Overlay
+    from client.carLib.thinkland_rpi_trace import LatencyTracer
 else:
     from carLib.thinkland_rpi_camera_client import Camera
     from carLib.thinkland_rpi_car_client import Car
     from aiLib.thinkland_rpi_ai import Ai
+    from aiLib.thinkland_rpi_ai_tracker import TrackingDetector
+    from aiLib.thinkland_rpi_ai_overlay import Overlay
+    from carLib.thinkland_rpi_trace import LatencyTracer
 
 import random
 import time
 import cv2
+import numpy as np
 
 from pynput import keyboard
 from pynput.keyboard import Key
@@ -104,21 +111,31 @@ def Cruising(car, speed=4):
         car.stop_all_wheels()
 
 
-def find_object(camera, ai, object):
+def find_object(camera, ai, object, overlay=None):
     global CRUSING_FLOG
     global STOP_FLAGE
-    while True:
-        pic = camera.take_picture()
-        ret, names, _ = ai.find_object(pic)
+    detector = camera.subscribe('find_object')  # 订阅最新帧，和显示线程共享解码结果
+    try:
+        while True:
+            loan = detector.get()
+            if loan is None:
+                break
+            with loan as pic:  # 只读图像，不拷贝；识别时不在图像上绘制
+                detections = ai.detect(pic, loan.seq)
+            names = detections.names
+            if overlay is not None:
+                overlay.update(detections)  # 由显示线程画框
 
-        if STOP_FLAGE == True:
-            print('find object over .............................................')
-            break
+            if STOP_FLAGE == True:
+                print('find object over .............................................')
+                break
 
-        if 'cup' in names and CRUSING_FLOG is True:
-            print("find a cup")
-            CRUSING_FLOG = False
-            return
+            if 'cup' in names and CRUSING_FLOG is True:
+                print("find a cup")
+                CRUSING_FLOG = False
+                return
+    finally:
+        detector.close()
 
 
 def demo_move_find_object(ip, object, vAngle=30, hAngle=90):
@@ -144,7 +161,7 @@ def demo_move_find_object(ip, object, vAngle=30, hAngle=90):
     camera.thread_play()
 
     ai = Ai(classes="./aiLib/coco/coco.names", config="./aiLib/coco/yolov3.cfg",
-            weight="./aiLib/coco/yolov3.weights")
+            weights="./aiLib/coco/yolov3.weights")
 
     car.turn_servo_camera_vertical(vAngle)
     car.turn_servo_camera_horizental(hAngle)
@@ -183,7 +200,7 @@ def demo_step_find_object(ip, speed=20, dis=1, object='cup', vAngle=30, hAngle=9
     camera.thread_play()
 
     ai = Ai(classes="./aiLib/coco/coco.names", config="./aiLib/coco/yolov3.cfg",
-            weight="./aiLib/coco/yolov3.weights")
+            weights="./aiLib/coco/yolov3.weights")
 
     car.turn_servo_camera_vertical(vAngle)
     car.turn_servo_camera_horizental(hAngle)
@@ -231,7 +248,7 @@ def demo_move_step_find_object(ip, speed=20, dis=1, object='cup', vAngle=40, hAn
     camera.thread_play()
 
     ai = Ai(classes="./aiLib/coco/coco.names", config="./aiLib/coco/yolov3.cfg",
-            weight="./aiLib/coco/yolov3.weights")
+            weights="./aiLib/coco/yolov3.weights")
 
     car.turn_servo_camera_vertical(vAngle)
     car.turn_servo_camera_horizental(hAngle)
@@ -283,33 +300,23 @@ def get_status_with_camera(car, camera, ai, object):
     vTable = [25, 45]  # 角度 垂直方向
     hTable = [45, 90, 135]  # 角度 水平方向
     global STOP_FLAGE
-    for pos in vTable:
-        car.turn_servo_camera_vertical(pos)
-        print('pos:', pos)
-        for angle in hTable:
-
-            if STOP_FLAGE == True:
-                car.stop_all_wheels()
-                print('Cruising over .............................................')
-                break
-
-            print('angle:', angle)
-            car.turn_servo_camera_horizental(angle)
-            time.sleep(2)  # 图像稳定时间
-            picture = camera.take_picture()
-            frame, names, _ = ai.find_object(picture)
-            print(names)
-            for item in names:
-                if item == object:
-                    if pos < 40:
-                        return 'status_stop'
-                    else:
-                        if angle == 90:
-                            return 'status_move'
-                        elif angle < 90:
-                            return 'status_turn_right'
-                        else:
-                            return 'status_turn_left'
+    # 先在所有角度拍照，再一次批量识别
+    poses = [(pos, angle) for pos in vTable for angle in hTable]
+    for (pos, angle), _, detections in ai.sweep(car, camera, poses, stop=lambda: STOP_FLAGE):
+        print('pos:', pos, 'angle:', angle, detections.names)
+        if object in detections.names:
+            if pos < 40:
+                return 'status_stop'
+            else:
+                if angle == 90:
+                    return 'status_move'
+                elif angle < 90:
+                    return 'status_turn_right'
+                else:
+                    return 'status_turn_left'
+    if STOP_FLAGE == True:
+        car.stop_all_wheels()
+        print('Cruising over .............................................')
     return 'status_move'
 
 def check_object(ai,pic,object):
@@ -330,7 +337,7 @@ def check_object(ai,pic,object):
      ---------
      返回‘find’和‘nothing’两种结果
     """
-    ret, names, box = ai.find_object(pic)
+    ret, names, box = ai.find_object(pic, annotate=False)
     for item in names:
         if item == object:
             return 'find'
@@ -371,7 +378,7 @@ def check_object_step(camera,car,ai,object):
             return 'nothing'
     return 'nothing'
 
-def move_step_find_object1_thread(ip, camera, ai, object, vAngle, hAngle):
+def move_step_find_object1_thread(ip, camera, ai, object, vAngle, hAngle, tracer=None, overlay=None):
     """
     小车移动寻找目标
      Parameter
@@ -388,6 +395,10 @@ def move_step_find_object1_thread(ip, camera, ai, object, vAngle, hAngle):
          --相机垂直角度
      *hAngle:int
          --相机水平角度
+     *tracer:LatencyTracer
+         --延迟跟踪，None表示不跟踪
+     *overlay:Overlay
+         --显示识别结果，None表示不显示
      Return
      ---------
      None
@@ -395,6 +406,8 @@ def move_step_find_object1_thread(ip, camera, ai, object, vAngle, hAngle):
     global CRUSING_FLOG
     global STOP_FLAGE
     global CAMERA_FLAGE
+    if tracer is None:
+        tracer = LatencyTracer(enabled=False)
     car = Car(ip)
     car.turn_servo_camera_vertical(vAngle)
     car.turn_servo_camera_horizental(hAngle)#运动到相机指定方向
@@ -407,60 +420,57 @@ def move_step_find_object1_thread(ip, camera, ai, object, vAngle, hAngle):
         if ret == 'find':
             break
         if ret == 'nothing':#没有找到，从新找
-            mainThread_ = threading.Thread(target=find_object, args=(camera, ai, object,))
+            mainThread_ = threading.Thread(target=find_object, args=(camera, ai, object, overlay,))
             mainThread_.start()
             CRUSING_FLOG = True
 
     car.spin_left(2, 0.1)  # 回转，减少误差
 
     start_sensor_check = False
+    # 靠近目标时只识别目标附近的窗口(原始分辨率)，丢失时回到全图识别；模型由注册表共用，不会重新加载
+    follower = Ai(ai.classesFile, ai.modelConfiguration, ai.modelWeights)
+    follower.set_roi(object)
+    # 每隔5帧识别一次，中间的帧用光流跟踪目标，跟踪到的位置同时更新follower的识别窗口
+    tracker = TrackingDetector(follower, interval=5, names=object)
 
     while True:
         if STOP_FLAGE == True:
             car.stop_all_wheels()
             print('Cruising over .............................................')
+            print(tracker.stats())
             return
 
-        pic = camera.take_picture()
-        y = []
-        x = []
+        centres = []
         x1 = 320
         y1 = 0
 
         for i in range(1):#多张图寻找
-            ret, names, box = ai.find_object(pic)
-            for item in names:
-                if item == object:
-                    id = names.index(item)
-                    print(box[id])
-                    y.append(box[id][1])
-                    x.append(box[id][0])
-
-        #多张图求平均
-        ysum = 0
-        for d in y:
-            ysum = ysum + d
-        if len(y) > 0:
-            y1 = ysum / len(y)
-            print(y1)
-
-        #多张图，求取x平均
-        xsum = 0
-        for d in x:
-            xsum = xsum + d
-        if len(x) > 0:
-            x1 = xsum / len(x)
-            print(x1)
-
-
-        if x1 > 360:#右转
-            print('turn right')
-            car.turn_right(4, 0.1)
-        elif x1 < 200:#左转
-            print('turn left')
-            car.turn_left(4, 0.1)
-        else:#直行
-            car.run_forward(4, 0.2)
+            loan = camera.borrow_picture()
+            tracer.record_decode(loan)
+            with loan as pic, tracer.span('detect', loan):
+                detections = tracker.detect(pic, loan.seq)
+            if overlay is not None:
+                overlay.update(detections)
+            target = detections.best(object)#同一张图有多个目标时取置信度最高的
+            if target is not None:
+                print(target)
+                centres.append((target['x'] + target['w'] / 2, target['y'] + target['h'] / 2))
+
+        with tracer.span('decision', loan):
+            #多张图求平均
+            if len(centres) > 0:
+                x1, y1 = np.mean(centres, axis=0)
+                print(x1, y1)
+
+        with tracer.span('car', loan):
+            if x1 > 360:#右转
+                print('turn right')
+                car.turn_right(4, 0.1)
+            elif x1 < 200:#左转
+                print('turn left')
+                car.turn_left(4, 0.1)
+            else:#直行
+                car.run_forward(4, 0.2)
         if y1 > 300:#说明车子靠近目标，启动超声波，相机向下移动一点
             start_sensor_check = True
             car.turn_servo_camera_vertical(vAngle + 2)
@@ -484,6 +494,7 @@ def move_step_find_object1_thread(ip, camera, ai, object, vAngle, hAngle):
         print("distance",distance_to_obstacle)
         if( 0 < distance_to_obstacle and distance_to_obstacle < 30):#检查范围，满足条件说明，车找到杯子了
             print("find cup")
+            print(tracker.stats(), follower.roi.stats())
             return
 
 
@@ -492,7 +503,7 @@ def move_step_find_object1_thread(ip, camera, ai, object, vAngle, hAngle):
 
 
 
-def demo_move_step_find_object1(ip, speed=20, dis=1, object='cup', vAngle=65, hAngle=90):
+def demo_move_step_find_object1(ip, speed=20, dis=1, object='cup', vAngle=65, hAngle=90, trace_path=None):
     """
     连续移动寻找物体
 
@@ -506,21 +517,29 @@ def demo_move_step_find_object1(ip, speed=20, dis=1, object='cup', vAngle=65, hA
          -垂直方向的角度
      *hAngle:int
          -水平方向的角度
+     *trace_path:string
+         -不为None时跟踪靠近目标时每一帧的延迟，关闭显示后打印并导出Chrome trace文件
     """
+    tracer = LatencyTracer(enabled=trace_path is not None)
     camera = Camera()
     camera.connect_server(ip)
     camera.start_receive()
 
 
-    ai = Ai()
+    ai = Ai(replicas=2)  # find_object和寻物两个线程同时识别，各用一个网络副本
+    overlay = Overlay(ai)  # 识别线程只保存结果，显示时才在拷贝上画框
 
-    mainThread_ = threading.Thread(target=find_object, args=(camera, ai, object,))
+    mainThread_ = threading.Thread(target=find_object, args=(camera, ai, object, overlay,))
     mainThread_.start()#启动相机查看功能
 
-    moveThread_ = threading.Thread(target=move_step_find_object1_thread,args=(ip, camera, ai, object, vAngle, hAngle,))
+    moveThread_ = threading.Thread(target=move_step_find_object1_thread,args=(ip, camera, ai, object, vAngle, hAngle, tracer, overlay,))
     moveThread_.start()#启动寻物
 
-    camera.play()#图像显示
+    camera.play(overlay)#图像显示
+
+    if trace_path is not None:
+        tracer.report()
+        tracer.export_chrome_trace(trace_path)
 
 #########################################################################################
 #注意运动类Car,在那个线程启动，就只能在那个线程调用
@@ -101,7 +101,7 @@ def find_object(camera, ai, object):
     CRUSING_FLOG = True
     while CRUSING_FLOG:
         pic = camera.take_picture()
-        ret, names, _ = ai.find_object(pic)
+        ret, names, _ = ai.find_object(pic, annotate=False)
 
         if STOP_FLAGE == True:
             print('find object over .............................................')
@@ -135,7 +135,7 @@ def demo_move_find_object(ip, object, vAngle=30, hAngle=90):
     camera.thread_play()
 
     ai = Ai(classes="./aiLib/coco/coco.names", config="./aiLib/coco/yolov3.cfg",
-            weight="./aiLib/coco/yolov3.weights")
+            weights="./aiLib/coco/yolov3.weights")
 
     car.turn_servo_camera_vertical(vAngle)
     car.turn_servo_camera_horizental(hAngle)
@@ -174,7 +174,7 @@ def demo_step_find_object(ip, speed=20, dis=1, object='cup', vAngle=30, hAngle=9
     camera.thread_play()
 
     ai = Ai(classes="./aiLib/coco/coco.names", config="./aiLib/coco/yolov3.cfg",
-            weight="./aiLib/coco/yolov3.weights")
+            weights="./aiLib/coco/yolov3.weights")
 
     car.turn_servo_camera_vertical(vAngle)
     car.turn_servo_camera_horizental(hAngle)
@@ -222,7 +222,7 @@ def demo_move_step_find_object(ip, speed=20, dis=1, object='cup', vAngle=40, hAn
     camera.thread_play()
 
     ai = Ai(classes="./aiLib/coco/coco.names", config="./aiLib/coco/yolov3.cfg",
-            weight="./aiLib/coco/yolov3.weights")
+            weights="./aiLib/coco/yolov3.weights")
 
     car.turn_servo_camera_vertical(vAngle)
     car.turn_servo_camera_horizental(hAngle)
@@ -288,7 +288,7 @@ def get_status_with_camera(car, camera, ai, object):
             car.turn_servo_camera_horizental(angle)
             time.sleep(2)  # 图像稳定时间
             picture = camera.take_picture()
-            frame, names, _ = ai.find_object(picture)
+            frame, names, _ = ai.find_object(picture, annotate=False)
             print(names)
             for item in names:
                 if item == object:
@@ -307,7 +307,7 @@ def get_status_with_camera(car, camera, ai, object):
 def find_cup(camera, ai):
     for i in range(2):
         pic = camera.take_picture()
-        ret, names, box = ai.find_object(pic)
+        ret, names, box = ai.find_object(pic, annotate=False)
         try:
             if 'cup' in names:
                 print("find a cup", names)
@@ -114,25 +114,16 @@ def demo_shaking_camera_find_object1(ip ,object):
     speaker = Speaker()
 
 
-    for pos in range(25,55,15):
-        car.turn_servo_camera_vertical(pos)
-        for angle in range(20, 180, 20):
-            car.turn_servo_camera_horizental(angle)
-            time.sleep(2)  #图像稳定时间
-            picture = camera.take_picture()
-            frame, names, _ = ai.find_object(picture)
-
-            if STOP_FLAGE:
-                return
-
-            print(names)
-            for item in names:
-                if item == object:
-                    speaker.say("find a")
-                    speaker.say(item)
-                    cv2.imshow('result', frame)
-                    cv2.waitKey(0)
-                    return
+    # 先在所有角度拍照，再一次批量识别
+    poses = [(pos, angle) for pos in range(25, 55, 15) for angle in range(20, 180, 20)]
+    for pose, picture, detections in ai.sweep(car, camera, poses, stop=lambda: STOP_FLAGE):
+        print(pose, detections.names)
+        if object in detections.names:
+            speaker.say("find a")
+            speaker.say(object)
+            cv2.imshow('result', ai.annotate(picture, detections))
+            cv2.waitKey(0)
+            return
 
 if __name__ == "__main__":
     start_listenser_thread()